@@ -9,21 +9,45 @@ import pandas as pd
 import numpy as np
 import datetime
 from datetime import time as dt_time
-from functools import wraps
+from functools import wraps, lru_cache
 from flask import Flask, render_template, request, redirect, url_for, flash, Response, session, send_file, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:
+    PasswordHasher = None
 from flask_talisman import Talisman
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_session import Session
 import bleach
 # from flask_wtf.csrf import CSRFProtect
-from logger_config import antigravity_trace, track_runtime_value
+from logger_config import antigravity_trace, track_runtime_value, setup_async_console_logger
 import cv2
 import math
-from collections import deque
+import threading
+import sqlite3
+import heapq
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from collections import deque, Counter
+
+# Let OpenCV use its optimized (IPP/SIMD) kernels and all but one core
+cv2.setUseOptimized(True)
+cv2.setNumThreads(max(1, (os.cpu_count() or 2) - 1))
 
 # Initialize Face Cascade
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+HAAR_CASCADE_FILE = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+face_cascade = cv2.CascadeClassifier(HAAR_CASCADE_FILE)
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Required for flash messages
@@ -41,6 +65,7 @@ DATASET_DIR = os.path.join(BASE_DIR, 'dataset')
 PERIODS_FILE = os.path.join(BASE_DIR, 'periods.json')
 ATTENDANCE_PERIOD_FILE = os.path.join(BASE_DIR, 'attendance_period.json')
 MODEL_FILE = os.path.join(BASE_DIR, 'trainer.yml')
+APP_LOG_FILE = os.path.join(BASE_DIR, 'app.log')
 GRACE_PERIOD_MINUTES = 5
 MIN_ATTENDANCE_PERCENTAGE = 60
 SESSION_TIMEOUT = 1800  # 30 minutes in seconds
@@ -50,6 +75,12 @@ LOCKOUT_DURATION = 900  # 15 minutes in seconds
 # Ensure dataset directory exists
 os.makedirs(DATASET_DIR, exist_ok=True)
 
+# Server-side sessions: the cookie only carries a (signed) session id
+app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_FILE_DIR'] = os.path.join(BASE_DIR, '.flask_session')
+app.config['SESSION_USE_SIGNER'] = True
+Session(app)
+
 # ==================== SECURITY CONFIGURATION ====================
 # Initialize Talisman for security headers
 csp = {
@@ -77,36 +108,170 @@ talisman = Talisman(
 )
 
 # Initialize rate limiter
+# Point RATELIMIT_STORAGE_URI at Redis (e.g. redis://localhost:6379/0) when running
+# several workers so they share counters; memory:// is per-process.
+RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["1000 per hour", "100 per minute"],
-    storage_uri="memory://",
-    strategy="fixed-window"
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy="moving-window",
+    in_memory_fallback_enabled=True  # Keep limiting per-process if Redis is unreachable
 )
 
-def load_students():
-    if not os.path.exists(STUDENTS_FILE):
-        return {}
-    with open(STUDENTS_FILE, 'r') as f:
+# ==================== JSON FILE CACHE ====================
+# {path: ((mtime_ns, size), data)} - files are only re-parsed when they change on disk.
+# Cached objects are shared between callers and must not be mutated outside the save
+# path: edit the loaded object and save it straight back, or the cache drifts from disk.
+_json_cache = {}
+# {path: save count} - in-place edits keep the cached object's identity, so saves are counted
+_json_saves = {}
+
+def json_loads(data):
+    """Parse JSON text/bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(data, indent=True, default=None):
+    """Serialize to JSON bytes, using orjson when it is installed (2-space indent)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+    return json.dumps(data, indent=4 if indent else None, default=default).encode('utf-8')
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _load_json_cached(path, default):
+    """Load a JSON file, reusing the parsed data while its mtime/size is unchanged"""
+    try:
+        signature = _file_signature(path)
+    except OSError:
+        return default
+    cached = _json_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(path, 'rb') as f:
         try:
-            return json.load(f)
+            data = json_loads(f.read())
         except json.JSONDecodeError:
-            return {}
+            return default
+    _json_cache[path] = (signature, data)
+    return data
+
+def _update_json_cache(path, data):
+    """Record freshly written data so the next load doesn't re-read the file"""
+    _json_saves[path] = _json_saves.get(path, 0) + 1
+    try:
+        _json_cache[path] = (_file_signature(path), data)
+    except OSError:
+        _json_cache.pop(path, None)
+
+def json_cache_version(path):
+    """Token that changes whenever path is saved in-process or changes on disk"""
+    cached = _json_cache.get(path)
+    return (_json_saves.get(path, 0), cached[0] if cached else None)
+
+def load_students():
+    return _load_json_cached(STUDENTS_FILE, {})
 
 def save_students(data):
-    with open(STUDENTS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    with open(STUDENTS_FILE, 'wb') as f:
+        f.write(json_dumps(data))
+    _update_json_cache(STUDENTS_FILE, data)
+
+_student_ids_cache = {"version": None, "ids": {}}
+
+def get_student_ids():
+    """Map integer recognizer labels to student records, rebuilt when the students change"""
+    students = load_students()
+    version = json_cache_version(STUDENTS_FILE)
+    if _student_ids_cache["version"] != version:
+        _student_ids_cache["ids"] = {int(k): v for k, v in students.items() if k.isdigit()}
+        _student_ids_cache["version"] = version
+    return _student_ids_cache["ids"]
+
+# ==================== PASSWORD HASHING ====================
+# Argon2id tuned to roughly 50 ms per verify (vs. werkzeug's much slower scrypt default).
+# Existing scrypt/pbkdf2 hashes still verify and are upgraded on the next successful login.
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1) if PasswordHasher else None
+_dummy_hash = None
+
+def hash_password(password):
+    """Hash a password with Argon2id (werkzeug scrypt if argon2-cffi is missing)"""
+    if _password_hasher is not None:
+        return _password_hasher.hash(password)
+    return generate_password_hash(password, method='scrypt')
+
+def verify_password(password_hash, password):
+    """Check a password against an Argon2 or legacy werkzeug hash"""
+    if password_hash.startswith('$argon2'):
+        if _password_hasher is None:
+            return False
+        try:
+            return _password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """True when a stored hash should be replaced with the current Argon2 parameters"""
+    if _password_hasher is None:
+        return False
+    if not password_hash.startswith('$argon2'):
+        return True
+    return _password_hasher.check_needs_rehash(password_hash)
+
+def burn_password_check(password):
+    """Spend one verify's worth of work so unknown usernames take as long as real ones"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(uuid.uuid4().hex)
+    verify_password(_dummy_hash, password)
 
 # ==================== USER MANAGEMENT FUNCTIONS ====================
-@antigravity_trace
-def load_users():
-    """Load users from JSON file with anti-gravity tracing"""
+# Login bookkeeping (last_login, failed_attempts, locks) is appended here instead of
+# rewriting users.json; the log is folded back into a snapshot every N events.
+USERS_EVENTS_FILE = os.path.join(BASE_DIR, 'users_events.log')
+USER_EVENTS_COMPACT_THRESHOLD = 200
+
+_users_lock = threading.RLock()
+_users_state = None
+_users_signature = None
+_user_events_count = 0
+# email -> username and reset_token -> username, rebuilt whenever the users are re-read
+_users_email_index = {}
+_users_token_index = {}
+
+def _index_users(users):
+    global _users_email_index, _users_token_index
+    email_index, token_index = {}, {}
+    for username, user_data in users.items():
+        if user_data.get('email'):
+            email_index.setdefault(user_data['email'], username)
+        if user_data.get('reset_token'):
+            token_index.setdefault(user_data['reset_token'], username)
+    _users_email_index, _users_token_index = email_index, token_index
+
+def _user_events_signature():
+    try:
+        return _file_signature(USERS_EVENTS_FILE)
+    except OSError:
+        return None
+
+def _ensure_users_file():
+    """Create users.json with the default admin account on first run"""
     if not os.path.exists(USERS_FILE):
         # Create default admin user
         default_users = {
             "admin": {
-                "password_hash": generate_password_hash("Admin@123", method='scrypt'),
+                "password_hash": hash_password("Admin@123"),
                 "role": "admin",
                 "email": "admin@school.edu",
                 "created_at": datetime.datetime.now().isoformat(),
@@ -118,24 +283,104 @@ def load_users():
             }
         }
         save_users(default_users)
-        return default_users
+
+@antigravity_trace
+def load_users():
+    """Load users from JSON file (snapshot + event log) with anti-gravity tracing"""
+    global _users_state, _users_signature, _user_events_count
     try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
+        with _users_lock:
+            # Only rebuilt when users.json or the event log changes on disk
+            signature = (_file_signature(USERS_FILE), _user_events_signature())
+            if _users_state is not None and signature == _users_signature:
+                return _users_state
+            
+            with open(USERS_FILE, 'rb') as f:
+                try:
+                    users = json_loads(f.read())
+                except json.JSONDecodeError as e:
+                    print(f"Error loading users: {e}")
+                    return {}
+            
+            # Replay per-login updates recorded since the last snapshot
+            _user_events_count = 0
+            if signature[1] is not None:
+                with open(USERS_EVENTS_FILE, 'rb') as f:
+                    for line in f:
+                        try:
+                            event = json_loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if event.get('user') in users:
+                            users[event['user']].update(event.get('changes', {}))
+                        _user_events_count += 1
+            
+            _users_state = users
+            _users_signature = signature
+            _index_users(users)
+            return users
+    except IOError as e:
         print(f"Error loading users: {e}")
         return {}
 
 @antigravity_trace
 def save_users(users_data):
-    """Save users to JSON file with anti-gravity tracing"""
+    """Save a full users snapshot and truncate the event log it now contains"""
+    global _users_state, _users_signature, _user_events_count
     try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users_data, f, indent=4, default=str)
+        with _users_lock:
+            tmp_path = USERS_FILE + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps(users_data, default=str))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, USERS_FILE)
+            if os.path.exists(USERS_EVENTS_FILE):
+                open(USERS_EVENTS_FILE, 'w').close()
+            
+            _users_state = users_data
+            _users_signature = (_file_signature(USERS_FILE), _user_events_signature())
+            _user_events_count = 0
+            _index_users(users_data)
     except IOError as e:
         print(f"Error saving users: {e}")
         raise
 
+def append_user_event(username, changes):
+    """Record small per-user field updates (login bookkeeping) as one appended line"""
+    global _users_signature, _user_events_count
+    with _users_lock:
+        with open(USERS_EVENTS_FILE, 'ab') as f:
+            f.write(json_dumps({"user": username, "changes": changes}, indent=False, default=str) + b"\n")
+        
+        if _users_state is not None and username in _users_state:
+            _users_state[username].update(changes)
+        if _users_signature is not None:
+            _users_signature = (_users_signature[0], _user_events_signature())
+        _user_events_count += 1
+        
+        if _user_events_count >= USER_EVENTS_COMPACT_THRESHOLD:
+            compact_users()
+
+def compact_users():
+    """Fold the event log back into users.json"""
+    with _users_lock:
+        save_users(load_users())
+
+def find_user_by_email(users, email):
+    """Return the username registered with email, or None"""
+    username = _users_email_index.get(email)
+    if username in users and users[username].get('email') == email:
+        return username
+    return None
+
+def find_user_by_reset_token(users, token):
+    """Return the username holding reset token, or None"""
+    username = _users_token_index.get(token)
+    if username in users and users[username].get('reset_token') == token:
+        return username
+    return None
+
 @antigravity_trace
 def create_user(username, password, email, role="viewer"):
     """Create new user with validation and anti-gravity tracing"""
@@ -149,10 +394,6 @@ def create_user(username, password, email, role="viewer"):
     if not is_valid:
         return False, msg
     
-    # Hash password with performance tracking
-    def hash_password(pwd):
-        return generate_password_hash(pwd, method='scrypt')
-    
     password_hash = hash_password(password)
     
     users[username] = {
@@ -170,16 +411,24 @@ def create_user(username, password, email, role="viewer"):
     save_users(users)
     return True, "User created successfully"
 
-@antigravity_trace
 def validate_password(password):
     """Validate password strength"""
     if len(password) < 12:
         return False, "Password must be at least 12 characters long"
     
-    has_upper = any(c.isupper() for c in password)
-    has_lower = any(c.islower() for c in password)
-    has_digit = any(c.isdigit() for c in password)
-    has_special = any(not c.isalnum() for c in password)
+    # Single pass over the password, stopping once every class has been seen
+    has_upper = has_lower = has_digit = has_special = False
+    for c in password:
+        if c.isupper():
+            has_upper = True
+        elif c.islower():
+            has_lower = True
+        elif c.isdigit():
+            has_digit = True
+        elif not c.isalnum():
+            has_special = True
+        if has_upper and has_lower and has_digit and has_special:
+            break
     
     if not (has_upper and has_lower and has_digit and has_special):
         return False, "Password must contain uppercase, lowercase, digit, and special character"
@@ -197,20 +446,23 @@ def login_required(f):
             return redirect(url_for('login', next=request.url))
         
         # Check session timeout
+        # last_activity is Unix time in seconds; sessions from before the switch hold an ISO string
+        now = int(time.time())
         last_activity = session.get('last_activity')
         if last_activity:
             try:
-                last_activity_time = datetime.datetime.fromisoformat(last_activity)
-                if datetime.datetime.now() - last_activity_time > datetime.timedelta(seconds=SESSION_TIMEOUT):
+                if isinstance(last_activity, str):
+                    last_activity = datetime.datetime.fromisoformat(last_activity).timestamp()
+                if now - last_activity > SESSION_TIMEOUT:
                     flash("Session expired. Please login again.", "error")
                     session.clear()
                     return redirect(url_for('login'))
-            except ValueError:
+            except (TypeError, ValueError):
                 session.clear()
                 return redirect(url_for('login'))
         
         # Update last activity
-        session['last_activity'] = datetime.datetime.now().isoformat()
+        session['last_activity'] = now
         
         return f(*args, **kwargs)
     return decorated_function
@@ -258,34 +510,45 @@ def validate_input(*validators):
         return decorated_function
     return decorator
 
+# Allow basic HTML tags for rich text if needed
+SANITIZE_ALLOWED_TAGS = ['b', 'i', 'u', 'em', 'strong', 'p', 'br']
+
+# Cleaner holds parser state and isn't thread-safe, so it's reused per thread
+_cleaner_local = threading.local()
+
+def _get_cleaner():
+    cleaner = getattr(_cleaner_local, 'cleaner', None)
+    if cleaner is None:
+        cleaner = bleach.sanitizer.Cleaner(tags=SANITIZE_ALLOWED_TAGS, strip=True)
+        _cleaner_local.cleaner = cleaner
+    return cleaner
+
 def sanitize_input(data):
     """Sanitize input data to prevent XSS"""
     if isinstance(data, str):
-        # Allow basic HTML tags for rich text if needed
-        allowed_tags = ['b', 'i', 'u', 'em', 'strong', 'p', 'br']
-        return bleach.clean(data, tags=allowed_tags, strip=True)
+        return _get_cleaner().clean(data)
     elif isinstance(data, dict):
         return {k: sanitize_input(v) for k, v in data.items()}
     elif isinstance(data, list):
         return [sanitize_input(item) for item in data]
     return data
+
+USERNAME_RE = re.compile(r'^[a-zA-Z0-9_\-\.]+$')
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
     
-@antigravity_trace
 def validate_username(username):
     """Validate username format"""
     if not 3 <= len(username) <= 50:
         return False, "Username must be between 3 and 50 characters"
     
-    if not re.match(r'^[a-zA-Z0-9_\-\.]+$', username):
+    if not USERNAME_RE.match(username):
         return False, "Username can only contain letters, numbers, dots, hyphens and underscores"
     
     return True, "Valid username"
 
-@antigravity_trace
 def validate_email(email):
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(pattern, email):
+    if not EMAIL_RE.match(email):
         return False, "Invalid email format"
     return True, "Valid email"
 
@@ -301,13 +564,12 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
         remember_me = request.form.get('remember_me') == 'on'
+        now = datetime.datetime.now()
         
-        def load_users_wrapper():
-            return load_users()
-        
-        users = load_users_wrapper()
+        users = load_users()
         
         if username not in users:
+            burn_password_check(password)
             flash("Invalid username or password", "error")
             return render_template('login.html')
         
@@ -315,8 +577,8 @@ def login():
         
         if user.get('locked_until'):
             locked_until = datetime.datetime.fromisoformat(user['locked_until'])
-            if datetime.datetime.now() < locked_until:
-                remaining = (locked_until - datetime.datetime.now()).seconds // 60
+            if now < locked_until:
+                remaining = (locked_until - now).seconds // 60
                 flash(f"Account locked. Try again in {remaining} minutes", "error")
                 return render_template('login.html')
             else:
@@ -327,15 +589,12 @@ def login():
             flash("Account is deactivated. Contact administrator.", "error")
             return render_template('login.html')
         
-        def verify_password(pwd_hash, pwd):
-            return check_password_hash(pwd_hash, pwd)
-        
         if verify_password(user['password_hash'], password):
             session['user_id'] = username
             session['user_role'] = user['role']
-            session['last_activity'] = datetime.datetime.now().isoformat()
+            session['last_activity'] = int(now.timestamp())
             
-            user['last_login'] = datetime.datetime.now().isoformat()
+            user['last_login'] = now.isoformat()
             user['failed_attempts'] = 0
             user['locked_until'] = None
             
@@ -344,7 +603,14 @@ def login():
             else:
                 session.permanent = False
             
-            save_users(users)
+            login_changes = {
+                'last_login': user['last_login'],
+                'failed_attempts': 0,
+                'locked_until': None
+            }
+            if password_needs_rehash(user['password_hash']):
+                login_changes['password_hash'] = hash_password(password)
+            append_user_event(username, login_changes)
             
             flash(f"Welcome back, {username}!", "success")
             next_page = request.args.get('next')
@@ -353,14 +619,17 @@ def login():
             user['failed_attempts'] = user.get('failed_attempts', 0) + 1
             
             if user['failed_attempts'] >= MAX_FAILED_ATTEMPTS:
-                lock_until = datetime.datetime.now() + datetime.timedelta(seconds=LOCKOUT_DURATION)
+                lock_until = now + datetime.timedelta(seconds=LOCKOUT_DURATION)
                 user['locked_until'] = lock_until.isoformat()
                 flash(f"Account locked for {LOCKOUT_DURATION//60} minutes due to too many failed attempts", "error")
             else:
                 remaining = MAX_FAILED_ATTEMPTS - user['failed_attempts']
                 flash(f"Invalid password. {remaining} attempts remaining", "error")
             
-            save_users(users)
+            append_user_event(username, {
+                'failed_attempts': user['failed_attempts'],
+                'locked_until': user.get('locked_until')
+            })
     
     return render_template('login.html')
 
@@ -411,11 +680,7 @@ def forgot_password():
     if request.method == 'POST':
         email = request.form.get('email', '').strip()
         users = load_users()
-        user_found = None
-        for username, user_data in users.items():
-            if user_data.get('email') == email:
-                user_found = username
-                break
+        user_found = find_user_by_email(users, email)
         
         if user_found:
             token = str(uuid.uuid4())
@@ -438,16 +703,11 @@ def forgot_password():
 def reset_password(token):
     """Reset password route with anti-gravity tracing"""
     users = load_users()
-    user_found = None
-    for username, user_data in users.items():
-        user_token = user_data.get('reset_token')
-        token_expiry = user_data.get('reset_token_expiry')
-        
-        if user_token == token and token_expiry:
-            expiry_time = datetime.datetime.fromisoformat(token_expiry)
-            if datetime.datetime.now() < expiry_time:
-                user_found = username
-                break
+    user_found = find_user_by_reset_token(users, token)
+    if user_found:
+        token_expiry = users[user_found].get('reset_token_expiry')
+        if not token_expiry or datetime.datetime.now() >= datetime.datetime.fromisoformat(token_expiry):
+            user_found = None
     
     if not user_found:
         flash("Invalid or expired reset token", "error")
@@ -466,7 +726,7 @@ def reset_password(token):
             flash(msg, "error")
             return render_template('reset_password.html', token=token)
         
-        users[user_found]['password_hash'] = generate_password_hash(password, method='scrypt')
+        users[user_found]['password_hash'] = hash_password(password)
         users[user_found]['last_password_change'] = datetime.datetime.now().isoformat()
         users[user_found].pop('reset_token', None)
         users[user_found].pop('reset_token_expiry', None)
@@ -514,7 +774,7 @@ def change_password():
             flash("User not found", "error")
             return redirect(url_for('profile'))
         
-        if not check_password_hash(user['password_hash'], current_password):
+        if not verify_password(user['password_hash'], current_password):
             flash("Current password is incorrect", "error")
             return redirect(url_for('change_password'))
         
@@ -527,7 +787,7 @@ def change_password():
             flash(msg, "error")
             return redirect(url_for('change_password'))
         
-        user['password_hash'] = generate_password_hash(new_password, method='scrypt')
+        user['password_hash'] = hash_password(new_password)
         user['last_password_change'] = datetime.datetime.now().isoformat()
         
         save_users(users)
@@ -647,15 +907,14 @@ def dashboard():
     current_period = get_current_period()
     
     # Get today's attendance data
-    attendance_data = load_period_attendance()
     today_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    attendance_data = load_period_attendance(today_str)
     day_data = attendance_data.get(today_str, {})
     
     # Calculate unique students present today (present in at least one period)
-    unique_present = 0
-    for roll_no, data in day_data.items():
-        if data.get('total_present', 0) > 0:
-            unique_present += 1
+    present_counts = np.fromiter((data.get('total_present', 0) for data in day_data.values()),
+                                 dtype=np.int32, count=len(day_data))
+    unique_present = int(np.count_nonzero(present_counts > 0))
             
     total_students = len(students)
     
@@ -723,6 +982,12 @@ def on_rm_error(func, path, exc_info):
     os.chmod(path, stat.S_IWRITE)
     func(path)
 
+def _remove_tree(path):
+    try:
+        shutil.rmtree(path, onerror=on_rm_error)
+    except Exception as e:
+        print(f"Error deleting folder {path}: {e}")
+
 @app.route("/delete_student/<roll_no>")
 @login_required
 @role_required('admin')
@@ -736,10 +1001,14 @@ def delete_student(roll_no):
         # Delete dataset folder
         student_folder = os.path.join(DATASET_DIR, roll_no)
         if os.path.exists(student_folder):
+            # Rename is a single metadata op; unlinking the images happens in the background
+            trash_folder = f"{student_folder}.deleted.{uuid.uuid4().hex}"
             try:
-                shutil.rmtree(student_folder, onerror=on_rm_error)
-            except Exception as e:
-                print(f"Error deleting folder {student_folder}: {e}")
+                os.rename(student_folder, trash_folder)
+            except OSError:
+                _remove_tree(student_folder)  # e.g. a file is still open on Windows
+            else:
+                threading.Thread(target=_remove_tree, args=(trash_folder,), daemon=True).start()
             
         flash(f"Student {name} deleted successfully!", "success")
     else:
@@ -752,28 +1021,178 @@ def delete_student(roll_no):
 def attendance():
     return render_template("attendance.html")
     
+# Only the end of app.log is read when serving /logs
+LOG_TAIL_BLOCK = 4096
+LOG_TAIL_LINES = 20
+
+def tail(path, n=LOG_TAIL_LINES, block=LOG_TAIL_BLOCK):
+    """Return the last n lines of a file (with line endings), reading backward by blocks"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        chunks = []
+        newlines = 0
+        # n + 1 newlines guarantee the n-th line from the end is complete
+        while pos > 0 and newlines <= n:
+            size = min(block, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+    data = b''.join(reversed(chunks))
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    if pos > 0 and lines:
+        lines = lines[1:]  # Drop the partial first line
+    return lines[-n:]
+
 @app.route('/logs')
 def get_logs():
     """Phase 4: Return last 20 log lines"""
-    log_file = os.path.join(BASE_DIR, 'app.log')
+    log_file = APP_LOG_FILE
     if not os.path.exists(log_file):
         return {"logs": ["Log file not found."]}
     
     try:
-        with open(log_file, 'r') as f:
-            lines = f.readlines()
-        return {"logs": lines[-20:]}
+        # Pollers that already have this version of the log get a bodyless 304
+        st = os.stat(log_file)
+        etag = f"{st.st_size}-{st.st_mtime_ns}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        response = jsonify({"logs": tail(log_file)})
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return {"logs": [f"Error reading logs: {str(e)}"]}
 
 
 
 # --- Phase 4: Face Capture ---
-import cv2
-
-# Initialize Face Detector
-# Uses the file included in cv2.data
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+# Face detection prefers OpenCV's YuNet DNN detector (needs OpenCV >= 4.8 and an ONNX
+# model from opencv_zoo next to app.py); otherwise the Haar cascade (one instance per thread).
+# The int8-quantized model is used when present (int8 dot products on AVX2/VNNI CPUs).
+YUNET_MODEL_CANDIDATES = [
+    os.path.join(BASE_DIR, 'face_detection_yunet_2023mar_int8.onnx'),
+    os.path.join(BASE_DIR, 'face_detection_yunet_2023mar.onnx'),
+]
+YUNET_MODEL_FILE = next((path for path in YUNET_MODEL_CANDIDATES if os.path.exists(path)), None)
+YUNET_SCORE_THRESHOLD = 0.6
+YUNET_NMS_THRESHOLD = 0.3
+USE_YUNET = hasattr(cv2, 'FaceDetectorYN') and YUNET_MODEL_FILE is not None
+
+# setInputSize() mutates the detector, so each camera thread gets its own instance
+_yunet_local = threading.local()
+
+def _get_yunet():
+    detector = getattr(_yunet_local, 'detector', None)
+    if detector is None:
+        detector = cv2.FaceDetectorYN.create(
+            YUNET_MODEL_FILE, "", (320, 320), YUNET_SCORE_THRESHOLD, YUNET_NMS_THRESHOLD, 5000,
+            cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU)
+        _yunet_local.detector = detector
+    return detector
+
+def _detect_yunet(small, small_min, small_max):
+    """Run YuNet on a downscaled gray frame and return [x, y, w, h] rows"""
+    detector = _get_yunet()
+    detector.setInputSize((small.shape[1], small.shape[0]))
+    _, faces = detector.detect(cv2.cvtColor(small, cv2.COLOR_GRAY2BGR))
+    if faces is None:
+        return np.empty((0, 4), dtype=np.float32)
+    boxes = faces[:, :4]
+    keep = (boxes[:, 2] >= small_min[0]) & (boxes[:, 3] >= small_min[1])
+    if small_max:
+        keep &= (boxes[:, 2] <= small_max[0]) & (boxes[:, 3] <= small_max[1])
+    boxes = boxes[keep]
+    # YuNet boxes can start slightly outside the frame; ROIs are sliced from them
+    boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+    return boxes
+
+# One CascadeClassifier must not run detectMultiScale from several threads at once, so
+# like YuNet each detector/request thread loads its own copy (the main thread reuses face_cascade)
+_cascade_local = threading.local()
+_cascade_local.cascade = face_cascade
+
+def _get_face_cascade():
+    cascade = getattr(_cascade_local, 'cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(HAAR_CASCADE_FILE)
+        _cascade_local.cascade = cascade
+    return cascade
+
+# Haar detection runs on a downscaled copy of the frame (0.5 = quarter of the pixels)
+DETECTION_DOWNSCALE = 0.5
+DETECTION_MAX_HEIGHT = 480
+
+def detect_faces(gray, scale_factor, min_neighbors, min_size, max_size=None, downscale=DETECTION_DOWNSCALE):
+    """Run face detection on a downscaled frame and return boxes in full-res coordinates.
+    
+    min_size/max_size are in full-res pixels and bound the pyramid levels scanned.
+    The detector input is also capped at DETECTION_MAX_HEIGHT rows for large frames.
+    scale_factor/min_neighbors only apply to the Haar fallback.
+    """
+    downscale = min(downscale, DETECTION_MAX_HEIGHT / gray.shape[0])
+    small = cv2.resize(gray, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+    small_min = (max(1, int(min_size[0] * downscale)), max(1, int(min_size[1] * downscale)))
+    small_max = (int(max_size[0] * downscale), int(max_size[1] * downscale)) if max_size else ()
+    if USE_YUNET:
+        faces = _detect_yunet(small, small_min, small_max)
+        if len(faces) == 0:
+            return []
+        return np.round(faces / downscale).astype(np.int32)
+    
+    faces = _get_face_cascade().detectMultiScale(
+        small,
+        scaleFactor=scale_factor,
+        minNeighbors=min_neighbors,
+        minSize=small_min,
+        maxSize=small_max,
+        flags=cv2.CASCADE_DO_CANNY_PRUNING
+    )
+    if len(faces) == 0:
+        return []
+    return np.round(np.asarray(faces) / downscale).astype(np.int32)
+
+# Full Haar scans run every N processed frames; boxes are reused/tracked in between
+DETECT_EVERY_N_FRAMES = 3
+TRACK_SEARCH_MARGIN = 20  # pixels searched around the previous box
+
+def track_faces(prev_gray, gray, faces, margin=TRACK_SEARCH_MARGIN):
+    """Follow previously detected boxes into the next frame with local template matching"""
+    height, width = gray.shape[:2]
+    tracked = []
+    for (x, y, w, h) in faces:
+        template = prev_gray[y:y+h, x:x+w]
+        th, tw = template.shape[:2]
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(width, x + w + margin), min(height, y + h + margin)
+        window = gray[y0:y1, x0:x1]
+        
+        if th == 0 or tw == 0 or window.shape[0] < th or window.shape[1] < tw:
+            tracked.append((x, y, w, h))
+            continue
+        
+        result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, _, _, (dx, dy) = cv2.minMaxLoc(result)
+        tracked.append((x0 + dx, y0 + dy, tw, th))
+    return tracked
+
+# CLAHE objects keep scratch buffers between apply() calls, so each camera
+# thread gets its own instance instead of creating one per face per frame.
+_clahe_local = threading.local()
+
+def _get_clahe(clip_limit):
+    """Return a cached per-thread CLAHE instance for the given clip limit"""
+    cache = getattr(_clahe_local, 'instances', None)
+    if cache is None:
+        cache = _clahe_local.instances = {}
+    clahe = cache.get(clip_limit)
+    if clahe is None:
+        clahe = cache[clip_limit] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
+    return clahe
 
 @app.route("/start_capture/<roll_no>")
 @login_required
@@ -781,23 +1200,34 @@ face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_fronta
 def start_capture(roll_no):
     return render_template("capture.html", roll_no=roll_no)
 
-@antigravity_trace
-def preprocess_face(face_img):
+# Per-thread 200x200 scratch pair for the intermediate preprocessing steps, so a
+# preprocessed face costs at most one allocation (none when the caller passes out=)
+_preprocess_local = threading.local()
+
+def _preprocess_scratch():
+    scratch = getattr(_preprocess_local, 'scratch', None)
+    if scratch is None:
+        scratch = (np.empty((200, 200), np.uint8), np.empty((200, 200), np.uint8))
+        _preprocess_local.scratch = scratch
+    return scratch
+
+def preprocess_face(face_img, out=None):
     """
     Standardize face image:
     1. Resize to fixed 200x200
     2. Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
     3. Apply Gaussian Blur to reduce noise
+    The result is written into out (a 200x200 uint8 array) when given.
     """
     try:
-        face_img = cv2.resize(face_img, (200, 200))
+        resized, equalized = _preprocess_scratch()
+        cv2.resize(face_img, (200, 200), dst=resized)
         
         # CLAHE
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        face_img = clahe.apply(face_img)
+        _get_clahe(2.0).apply(resized, dst=equalized)
         
         # Gaussian Blur (light)
-        face_img = cv2.GaussianBlur(face_img, (3, 3), 0)
+        face_img = cv2.GaussianBlur(equalized, (3, 3), 0, dst=out)
     except Exception as e:
         print(f"Error in preprocessing: {e}")
         # Fallback to simple resize if something fails
@@ -808,8 +1238,14 @@ def preprocess_face(face_img):
 
 # --- Enhanced Face Recognition with Multiple Improvements ---
 
-@antigravity_trace
-def enhanced_preprocess_face(face_img):
+# Constant filters for enhanced_preprocess_face, built once at import
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1,  9, -1],
+                           [-1, -1, -1]], dtype=np.float32)
+GAMMA = 1.2
+GAMMA_LUT = (np.power(np.arange(256, dtype=np.float64) / 255.0, 1.0 / GAMMA) * 255).astype(np.uint8)
+
+def enhanced_preprocess_face(face_img, out=None):
     """
     Enhanced face preprocessing with multiple techniques:
     1. Adaptive histogram equalization (CLAHE)
@@ -817,29 +1253,26 @@ def enhanced_preprocess_face(face_img):
     3. Sharpening filter
     4. Gamma correction
     5. Edge enhancement
+    The result is written into out (a 200x200 uint8 array) when given.
     """
     try:
+        # Intermediate steps ping-pong between the two scratch buffers
+        a, b = _preprocess_scratch()
+        
         # Resize to standard size
-        face_img = cv2.resize(face_img, (200, 200))
+        cv2.resize(face_img, (200, 200), dst=a)
         
         # Step 1: CLAHE for contrast enhancement
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        face_img = clahe.apply(face_img)
+        _get_clahe(3.0).apply(a, dst=b)
         
         # Step 2: Gaussian blur (light) for noise reduction
-        face_img = cv2.GaussianBlur(face_img, (3, 3), 0)
+        cv2.GaussianBlur(b, (3, 3), 0, dst=a)
         
         # Step 3: Sharpening filter
-        kernel = np.array([[-1, -1, -1],
-                          [-1,  9, -1],
-                          [-1, -1, -1]])
-        face_img = cv2.filter2D(face_img, -1, kernel)
+        cv2.filter2D(a, -1, SHARPEN_KERNEL, dst=b)
         
         # Step 4: Gamma correction
-        gamma = 1.2
-        inv_gamma = 1.0 / gamma
-        table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-        face_img = cv2.LUT(face_img, table)
+        face_img = cv2.LUT(b, GAMMA_LUT, dst=out)
         
     except Exception as e:
         print(f"Error in enhanced preprocessing: {e}")
@@ -848,6 +1281,55 @@ def enhanced_preprocess_face(face_img):
         
     return face_img
 
+# Per-thread int16 scratch for Laplacian output; grown to the largest image seen
+_lap_local = threading.local()
+
+def _lap_buffer(shape):
+    size = shape[0] * shape[1]
+    buf = getattr(_lap_local, 'buf', None)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=np.int16)
+        _lap_local.buf = buf
+    # A prefix of the flat buffer reshapes to a contiguous (h, w) view
+    return buf[:size].reshape(shape[0], shape[1])
+
+def laplacian_variance(gray):
+    """Blur score: variance of the Laplacian, computed on an int16 buffer.
+    
+    For uint8 input the default 3-tap Laplacian fits in int16, so this yields the
+    same value as cv2.Laplacian(gray, cv2.CV_64F).var() with a quarter of the memory traffic.
+    """
+    lap = cv2.Laplacian(gray, cv2.CV_16S, dst=_lap_buffer(gray.shape))
+    _, sigma = cv2.meanStdDev(lap)
+    return float(sigma[0, 0]) ** 2
+
+@antigravity_trace
+def enhanced_preprocess_face_batch(face_imgs, out=None):
+    """
+    Apply enhanced_preprocess_face to many crops at once.
+    Results go into one (N, 200, 200) uint8 array and gamma correction runs as a
+    single LUT pass over the whole stack; the spatial filters stay per image so
+    they never bleed across image borders.
+    Pass out (a contiguous (>=N, 200, 200) uint8 array) to reuse a buffer across calls.
+    """
+    if out is None:
+        out = np.empty((len(face_imgs), 200, 200), dtype=np.uint8)
+    else:
+        out = out[:len(face_imgs)]
+    clahe = _get_clahe(3.0)
+    a, b = _preprocess_scratch()
+    
+    for i, face_img in enumerate(face_imgs):
+        cv2.resize(face_img, (200, 200), dst=a)
+        clahe.apply(a, dst=b)
+        cv2.GaussianBlur(b, (3, 3), 0, dst=a)
+        cv2.filter2D(a, -1, SHARPEN_KERNEL, dst=out[i])
+    
+    if len(face_imgs):
+        stacked = out.reshape(-1, 200)
+        cv2.LUT(stacked, GAMMA_LUT, dst=stacked)
+    return out
+
 @antigravity_trace
 def calculate_face_quality(face_img):
     """
@@ -856,18 +1338,17 @@ def calculate_face_quality(face_img):
     """
     try:
         # Blur detection using Laplacian variance
-        blur_score = cv2.Laplacian(face_img, cv2.CV_64F).var()
-        
-        # Brightness (0-255, optimal around 128)
-        brightness_score = np.mean(face_img)
+        blur_score = laplacian_variance(face_img)
         
-        # Contrast (standard deviation)
-        contrast_score = np.std(face_img)
+        # Brightness (0-255, optimal around 128) and contrast (standard deviation), one pass
+        mean, std = cv2.meanStdDev(face_img)
+        brightness_score = float(mean[0, 0])
+        contrast_score = float(std[0, 0])
         
         # Overall quality score (0-100)
-        blur_quality = min(blur_score / 100, 1) * 40  # Max 40 points
-        brightness_quality = 30 - abs(brightness_score - 128) / 128 * 30  # Max 30 points
-        contrast_quality = min(contrast_score / 50, 1) * 30  # Max 30 points
+        blur_quality = min(blur_score * 0.01, 1) * 40  # Max 40 points
+        brightness_quality = 30 - abs(brightness_score - 128) * (30 / 128)  # Max 30 points
+        contrast_quality = min(contrast_score * 0.02, 1) * 30  # Max 30 points
         
         overall_quality = blur_quality + brightness_quality + contrast_quality
         
@@ -881,6 +1362,14 @@ def calculate_face_quality(face_img):
         print(f"Error calculating face quality: {e}")
         return {'blur_score': 0, 'brightness_score': 0, 'contrast_score': 0, 'overall_quality': 0}
 
+# Constant-velocity model shared by every tracker's Kalman filter (state x, y, dx, dy)
+KF_MEASUREMENT_MATRIX = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], np.float32)
+KF_TRANSITION_MATRIX = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32)
+KF_PROCESS_NOISE_COV = np.eye(4, dtype=np.float32) * 0.03
+
+# Recognition reliability looks at this many most recent results per student
+RELIABILITY_WINDOW = 5
+
 class EnhancedFaceTracker:
     """Enhanced face tracking with Kalman filter for smooth movement"""
     def __init__(self):
@@ -888,43 +1377,70 @@ class EnhancedFaceTracker:
         self.verification_buffers = {}
         self.recognition_history = {}
         self.kalman_filters = {}
+        self._measurement = np.empty((2, 1), np.float32)  # Reused by every correct() call
+        # Min-heap of (last_seen, roll_no); superseded entries are skipped when popped
+        self._seen_heap = []
+    
+    def touch(self, roll_no, now):
+        """Record that roll_no's tracker was updated at time now"""
+        self.trackers[roll_no]['last_seen'] = now
+        heapq.heappush(self._seen_heap, (now, roll_no))
+    
+    def expire_inactive(self, now, timeout):
+        """Drop trackers not seen for timeout seconds, popping only expired heap entries"""
+        heap = self._seen_heap
+        while heap and now - heap[0][0] > timeout:
+            seen, roll_no = heapq.heappop(heap)
+            tracker = self.trackers.get(roll_no)
+            if tracker is not None and tracker['last_seen'] == seen:
+                del self.trackers[roll_no]
+                self.kalman_filters.pop(roll_no, None)
         
     def update_kalman(self, roll_no, x, y):
         """Update Kalman filter for smooth tracking"""
         if roll_no not in self.kalman_filters:
             # Initialize Kalman filter
             kf = cv2.KalmanFilter(4, 2)
-            kf.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], np.float32)
-            kf.transitionMatrix = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32)
-            kf.processNoiseCov = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]], np.float32) * 0.03
+            kf.measurementMatrix = KF_MEASUREMENT_MATRIX
+            kf.transitionMatrix = KF_TRANSITION_MATRIX
+            kf.processNoiseCov = KF_PROCESS_NOISE_COV
             self.kalman_filters[roll_no] = kf
         
         kf = self.kalman_filters[roll_no]
-        kf.correct(np.array([[np.float32(x)], [np.float32(y)]]))
+        measurement = self._measurement
+        measurement[0, 0] = x
+        measurement[1, 0] = y
+        kf.correct(measurement)
         predicted = kf.predict()
-        return int(predicted[0][0]), int(predicted[1][0])
+        return int(predicted[0, 0]), int(predicted[1, 0])
     
     def update_recognition_history(self, roll_no, confidence, is_match):
         """Maintain recognition history for reliability"""
-        if roll_no not in self.recognition_history:
-            self.recognition_history[roll_no] = deque(maxlen=10)
-        
-        self.recognition_history[roll_no].append({
-            'confidence': confidence,
-            'is_match': is_match,
-            'timestamp': time.time()
-        })
+        # Per roll_no: [last RELIABILITY_WINDOW (confidence, is_match) pairs,
+        # running confidence sum, running match count] - updated in O(1)
+        history = self.recognition_history.get(roll_no)
+        if history is None:
+            history = self.recognition_history[roll_no] = [deque(maxlen=RELIABILITY_WINDOW), 0.0, 0]
+        
+        window = history[0]
+        if len(window) == RELIABILITY_WINDOW:
+            old_confidence, old_match = window[0]
+            history[1] -= old_confidence
+            history[2] -= old_match
+        window.append((confidence, is_match))
+        history[1] += confidence
+        history[2] += bool(is_match)
         
     def get_recognition_reliability(self, roll_no):
         """Calculate recognition reliability score"""
-        if roll_no not in self.recognition_history or len(self.recognition_history[roll_no]) < 3:
+        history = self.recognition_history.get(roll_no)
+        if history is None or len(history[0]) < 3:
             return 0.5  # Default medium reliability
         
-        history = list(self.recognition_history[roll_no])
-        recent_matches = sum(1 for h in history[-5:] if h['is_match'])
-        avg_confidence = np.mean([h['confidence'] for h in history[-5:]])
+        window, confidence_sum, recent_matches = history
+        avg_confidence = confidence_sum / len(window)
         
-        reliability = (recent_matches / 5) * 0.6 + (1 - avg_confidence / 100) * 0.4
+        reliability = (recent_matches / RELIABILITY_WINDOW) * 0.6 + (1 - avg_confidence / 100) * 0.4
         return min(max(reliability, 0), 1)
 
 # Global enhanced tracker
@@ -933,9 +1449,29 @@ enhanced_tracker = EnhancedFaceTracker()
 # Global attendance log
 attendance_log = deque(maxlen=100)  # Store last 100 entries
 
-def log_attendance_event(event_type, roll_no, name, confidence, quality_metrics=None):
-    """Log attendance events with timestamps"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# Log statistics, kept in step with appends/evictions so the polled log API doesn't rescan
+_attendance_log_lock = threading.Lock()
+_attendance_log_stats = {"present": Counter(), "unknown": 0}
+
+def _tally_log_entry(entry, delta):
+    """Add (delta=1) or remove (delta=-1) one log entry from the running statistics"""
+    if entry['event_type'] == 'ENTRY' and entry['roll_no'] != 'unknown':
+        present = _attendance_log_stats["present"]
+        present[entry['roll_no']] += delta
+        if present[entry['roll_no']] <= 0:
+            del present[entry['roll_no']]
+    elif entry['event_type'] == 'UNKNOWN_DETECTED':
+        _attendance_log_stats["unknown"] += delta
+
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Event lines are written to the console by a background thread, off the video loop
+attendance_event_logger = setup_async_console_logger('attendance')
+
+def log_attendance_event(event_type, roll_no, name, confidence, quality_metrics=None, timestamp=None):
+    """Log attendance events with timestamps (pass timestamp to reuse one formatted per frame)"""
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT)
     
     event_data = {
         'timestamp': timestamp,
@@ -946,45 +1482,229 @@ def log_attendance_event(event_type, roll_no, name, confidence, quality_metrics=
         'quality_metrics': quality_metrics
     }
     
-    attendance_log.append(event_data)
-    print(f"[LOG] {timestamp} - {event_type}: {name} ({roll_no}) - Confidence: {confidence}")
+    with _attendance_log_lock:
+        if len(attendance_log) == attendance_log.maxlen:
+            _tally_log_entry(attendance_log[0], -1)  # About to be evicted by the append
+        attendance_log.append(event_data)
+        _tally_log_entry(event_data, 1)
+    attendance_event_logger.info("[LOG] %s - %s: %s (%s) - Confidence: %s",
+                                 timestamp, event_type, name, roll_no, confidence)
+
+# Brightness/contrast are global statistics, so they are measured on a small copy
+CAMERA_QUALITY_STATS_SIZE = (320, 180)
 
-def check_camera_quality(frame):
-    """Check camera quality and return issues"""
+def check_camera_quality(gray):
+    """Check camera quality (from a grayscale frame) and return issues"""
     issues = []
     
-    # Convert to grayscale for analysis
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Check blur
-    blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+    # Check blur (full resolution: downscaling sharpens edges and would skew the threshold)
+    blur_score = laplacian_variance(gray)
     if blur_score < 50:
         issues.append("⚠ Camera blurry - adjust focus")
     
+    # Brightness and contrast in one meanStdDev pass over the small copy
+    small = cv2.resize(gray, CAMERA_QUALITY_STATS_SIZE, interpolation=cv2.INTER_AREA)
+    mean, std = cv2.meanStdDev(small)
+    
     # Check brightness
-    brightness = np.mean(gray)
+    brightness = mean[0, 0]
     if brightness < 50:
         issues.append("⚠ Too dark - improve lighting")
     elif brightness > 200:
         issues.append("⚠ Too bright - reduce lighting")
     
     # Check contrast
-    contrast = np.std(gray)
+    contrast = std[0, 0]
     if contrast < 30:
         issues.append("⚠ Low contrast - adjust camera settings")
     
     return issues
 
+# MJPEG responses must not be cached or buffered by browsers/reverse proxies
+STREAM_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate",
+    "Pragma": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+# JPEG quality for the MJPEG preview streams
+STREAM_JPEG_QUALITY = 80
+# 1280x720 feeds are processed at full size but streamed to the browser at this size
+STREAM_FRAME_SIZE = (960, 540)
+# Multipart boundary + headers preceding every JPEG in an MJPEG stream
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+def encode_jpeg(frame, quality=STREAM_JPEG_QUALITY):
+    """Encode a BGR frame to JPEG bytes (simplejpeg if installed, else OpenCV)"""
+    if simplejpeg is not None:
+        try:
+            return simplejpeg.encode_jpeg(frame, quality=quality, colorspace='BGR')
+        except ValueError:
+            # simplejpeg rejects non-contiguous arrays; fall through to OpenCV
+            pass
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 0])
+    return buffer.tobytes() if ret else None
+
+def downscale_for_stream(frame, size=STREAM_FRAME_SIZE):
+    """Shrink a processed frame to the streamed size (no-op if already that size)"""
+    if (frame.shape[1], frame.shape[0]) == size:
+        return frame
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def render_overlay(shape, draw):
+    """Rasterize static overlay graphics once; draw(canvas) paints onto a black canvas"""
+    overlay = np.zeros(shape, np.uint8)
+    draw(overlay)
+    return overlay, overlay.any(axis=2, keepdims=True)
+
+def apply_overlay(frame, rendered):
+    """Blit a render_overlay() result onto the frame in place"""
+    overlay, mask = rendered
+    np.copyto(frame, overlay, where=mask)
+
+# Process every Nth camera frame; frames in between are never copied or processed
+CAPTURE_FRAME_SKIP = 1  # Keep every frame during capture for pose variety
+ATTENDANCE_FRAME_SKIP = 3  # ~10 FPS is plenty for detection/recognition
+
+class CameraBroker:
+    """Single long-lived webcam reader shared by every video feed.
+    
+    A background thread keeps the latest frame; feeds wait for a newer frame instead
+    of opening their own VideoCapture. The camera is released after idle_timeout
+    seconds without readers and reopened on the next read().
+    
+    Each frame's grayscale version is produced once and shared by all feeds. With
+    raw_yuyv the camera delivers YUYV and gray is simply the Y plane.
+    """
+    def __init__(self, src=0, width=1280, height=720, idle_timeout=30, raw_yuyv=False):
+        self.src = src
+        self.width = width
+        self.height = height
+        self.idle_timeout = idle_timeout
+        self.raw_yuyv = raw_yuyv
+        self.cond = threading.Condition()
+        self.frame = None
+        self.gray = None
+        self.frame_id = 0
+        self.last_read = 0
+        self.thread = None
+    
+    def _open(self):
+        cap = cv2.VideoCapture(self.src)
+        if self.raw_yuyv:
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+        else:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        cap.set(cv2.CAP_PROP_FPS, 30)
+        return cap
+    
+    def _loop(self):
+        cap = self._open()
+        try:
+            while time.time() - self.last_read < self.idle_timeout:
+                success, frame = cap.read()
+                if not success:
+                    break
+                gray = None
+                if frame.ndim == 3 and frame.shape[2] == 2:
+                    # Raw YUYV: luma is channel 0, BGR is only needed for the preview
+                    gray = np.ascontiguousarray(frame[:, :, 0])
+                    frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_YUYV)
+                with self.cond:
+                    self.frame = frame
+                    self.gray = gray
+                    self.frame_id += 1
+                    self.cond.notify_all()
+        finally:
+            cap.release()
+            with self.cond:
+                self.frame = None
+                self.gray = None
+                self.thread = None
+                self.cond.notify_all()
+    
+    def read(self, min_id=0, timeout=2.0, with_gray=True):
+        """Wait for a frame with id >= min_id.
+        
+        Returns (frame_id, frame copy, shared read-only gray) or (None, None, None).
+        With with_gray=False the gray slot is None unless another feed already made it.
+        """
+        with self.cond:
+            self.last_read = time.time()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            ready = self.cond.wait_for(
+                lambda: self.frame is not None and self.frame_id >= min_id, timeout)
+            if not ready:
+                return None, None, None
+            if self.gray is None and with_gray:
+                # First reader of this frame converts it; later readers reuse the result
+                self.gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+                self.gray.flags.writeable = False
+            # Copy so each feed can draw its own overlay
+            return self.frame_id, self.frame.copy(), self.gray
+
+# Raw YUYV avoids the gray conversion but costs USB bandwidth (often <=10 FPS at 720p),
+# so MJPG stays the default
+CAMERA_RAW_YUYV = False
+
+camera_broker = CameraBroker(raw_yuyv=CAMERA_RAW_YUYV)
+
+class AsyncFaceDetector:
+    """Runs face detection on a worker thread, always on the newest submitted frame.
+    
+    submit() never blocks: a frame the worker hasn't reached yet is simply replaced.
+    latest() returns (seq, gray, faces) for the most recent finished detection.
+    """
+    def __init__(self, detect):
+        self.detect = detect
+        self.pending = deque(maxlen=1)
+        self.cond = threading.Condition()
+        self.result = (0, None, [])
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+    
+    def _loop(self):
+        seq = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running)
+                if not self.running:
+                    return
+                gray = self.pending.pop()
+            faces = self.detect(gray)
+            seq += 1
+            with self.cond:
+                self.result = (seq, gray, faces)
+    
+    def submit(self, gray):
+        with self.cond:
+            self.pending.append(gray)
+            self.cond.notify()
+    
+    def latest(self):
+        with self.cond:
+            return self.result
+    
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+# Accepted capture crops are preprocessed/saved this many at a time
+CAPTURE_BATCH_SIZE = 5
+
 def generate_capture_frames(roll_no):
     """Enhanced face capture with instructions and quality feedback"""
-    camera = cv2.VideoCapture(0)
-    
-    # Set camera properties
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    
     student_folder = os.path.join(DATASET_DIR, roll_no)
     os.makedirs(student_folder, exist_ok=True)
+    # Joined once; per-capture paths are a plain string concat
+    image_prefix = os.path.join(student_folder, "")
         
     count = 0
     max_images = 50
@@ -995,75 +1715,122 @@ def generate_capture_frames(roll_no):
         {"start": 30, "end": 40, "instruction": "Tilt head UP slightly", "angle": "up"},
         {"start": 40, "end": 50, "instruction": "Tilt head DOWN slightly", "angle": "down"}
     ]
+    frame_id = 0
+    # Instruction/progress text only changes when a face is captured
+    overlay_key = None
+    overlay = None
+    
+    # Accepted crops waiting for batch preprocessing: [(img_path, roi_gray)]
+    pending = []
+    
+    def flush_pending():
+        if not pending:
+            return
+        processed = enhanced_preprocess_face_batch([roi for _, roi in pending])
+        for (img_path, _), face_img in zip(pending, processed):
+            cv2.imwrite(img_path, face_img)
+        pending.clear()
+    
+    # Detection runs on a worker thread over the newest frame only, so the preview
+    # never waits on the cascade; boxes/labels from the last result are redrawn
+    detector = AsyncFaceDetector(
+        # minSize stays below the 100px "Too Far!" cutoff so that hint is still shown
+        lambda g: detect_faces(g, 1.3, 5, min_size=(60, 60), max_size=(480, 480)))
+    handled_seq = 0
+    frame_idx = 0
+    face_labels = []  # [(x, y, w, h, message, color)] from the last processed result
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-            
-        frame_display = cv2.resize(frame, (1280, 720))
-        gray = cv2.cvtColor(frame_display, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        
-        # Get current instruction
-        current_state = None
-        for state in capture_states:
-            if state["start"] <= count < state["end"]:
-                current_state = state
+    try:
+        while True:
+            frame_id, frame, gray = camera_broker.read(frame_id + CAPTURE_FRAME_SKIP)
+            if frame is None:
                 break
-        
-        instruction = current_state["instruction"] if current_state else "Completed!"
-        
-        # Instructions
-        cv2.putText(frame_display, f"Step: {instruction}", (50, 50), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-        cv2.putText(frame_display, f"Progress: {count}/{max_images}", (50, 90), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-        
-        for (x, y, w, h) in faces:
-            cv2.rectangle(frame_display, (x, y), (x+w, y+h), (255, 0, 0), 2)
             
-            if count < max_images:
-                roi_gray = gray[y:y+h, x:x+w]
-                quality = calculate_face_quality(roi_gray)
-                
-                # Quality rejection
-                quality_msg = ""
-                if quality['blur_score'] < 30: quality_msg = "Too Blurry!"
-                elif quality['brightness_score'] < 40: quality_msg = "Too Dark!"
-                elif w < 100 or h < 100: quality_msg = "Too Far!"
-                
-                if quality_msg:
-                    cv2.putText(frame_display, quality_msg, (x, y-10), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-                    continue
-                
-                # Good quality - capture
-                count += 1
-                face_img = enhanced_preprocess_face(roi_gray)
-                
-                angle = current_state["angle"] if current_state else "front"
-                img_path = os.path.join(student_folder, f"{count}_{angle}.jpg")
-                cv2.imwrite(img_path, face_img)
-                
-                cv2.putText(frame_display, "Good Capture!", (x, y-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        
-        if count >= max_images:
-            cv2.putText(frame_display, "CAPTURE COMPLETE!", (400, 360), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
+            if frame.shape[:2] == (720, 1280):
+                frame_display = frame
+            else:
+                frame_display = cv2.resize(frame, (1280, 720))
+                gray = cv2.resize(gray, (1280, 720))
+            # Faces barely move between frames, so in-between frames reuse the last boxes
+            if frame_idx % DETECT_EVERY_N_FRAMES == 0:
+                detector.submit(gray)
+            frame_idx += 1
+            
+            # Get current instruction
+            current_state = None
+            for state in capture_states:
+                if state["start"] <= count < state["end"]:
+                    current_state = state
+                    break
+            
+            instruction = current_state["instruction"] if current_state else "Completed!"
+            
+            # Instructions
+            if overlay_key != (instruction, count):
+                def draw_instructions(canvas):
+                    cv2.putText(canvas, f"Step: {instruction}", (50, 50), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+                    cv2.putText(canvas, f"Progress: {count}/{max_images}", (50, 90), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                overlay = render_overlay(frame_display.shape, draw_instructions)
+                overlay_key = (instruction, count)
+            apply_overlay(frame_display, overlay)
+            
+            # Quality checks/captures run once per new detection result
+            result_seq, det_gray, faces = detector.latest()
+            if result_seq != handled_seq:
+                handled_seq = result_seq
+                face_labels = []
+                for (x, y, w, h) in faces:
+                    if count >= max_images:
+                        face_labels.append((x, y, w, h, "", None))
+                        continue
+                    
+                    roi_gray = det_gray[y:y+h, x:x+w]
+                    quality = calculate_face_quality(roi_gray)
+                    
+                    # Quality rejection
+                    quality_msg = ""
+                    if quality['blur_score'] < 30: quality_msg = "Too Blurry!"
+                    elif quality['brightness_score'] < 40: quality_msg = "Too Dark!"
+                    elif w < 100 or h < 100: quality_msg = "Too Far!"
+                    
+                    if quality_msg:
+                        face_labels.append((x, y, w, h, quality_msg, (0, 0, 255)))
+                        continue
+                    
+                    # Good quality - capture (preprocessed and written in batches)
+                    count += 1
+                    angle = current_state["angle"] if current_state else "front"
+                    pending.append((f"{image_prefix}{count}_{angle}.jpg", roi_gray))
+                    if len(pending) >= CAPTURE_BATCH_SIZE or count >= max_images:
+                        flush_pending()
+                    
+                    face_labels.append((x, y, w, h, "Good Capture!", (0, 255, 0)))
+            
+            for (x, y, w, h, message, color) in face_labels:
+                cv2.rectangle(frame_display, (x, y), (x+w, y+h), (255, 0, 0), 2)
+                if message:
+                    cv2.putText(frame_display, message, (x, y-10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
             
-        ret, buffer = cv2.imencode('.jpg', frame_display)
-        if ret:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-               
-    camera.release()
+            if count >= max_images:
+                cv2.putText(frame_display, "CAPTURE COMPLETE!", (400, 360), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
+            
+            jpeg = encode_jpeg(downscale_for_stream(frame_display))
+            if jpeg:
+                yield MJPEG_PART_HEADER + jpeg + b'\r\n'
+    finally:
+        detector.stop()
+        # Stream closed mid-batch: still save what was accepted
+        flush_pending()
 
 @app.route("/video_feed_capture/<roll_no>")
 def video_feed_capture(roll_no):
     return Response(generate_capture_frames(roll_no), 
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers=STREAM_HEADERS)
 
 
 # --- Phase 5: Train Model ---
@@ -1072,40 +1839,108 @@ import numpy as np
 # Path for the trained model
 MODEL_FILE = os.path.join(BASE_DIR, 'trained_model.yml')
 
+# Canonical (height, width) of stored/preprocessed face crops
+FACE_SIZE = (200, 200)
+
+# imread/resize release the GIL, so decoding scales with cores
+TRAINING_LOAD_WORKERS = os.cpu_count() or 4
+
+# Decoded faces are cached per student as <roll>-<image count>-<newest mtime>.npy, so any
+# added, removed or re-captured image changes the name and a stale cache is never read
+TRAINING_CACHE_DIR = os.path.join(BASE_DIR, 'training_cache')
+
+def _load_training_image(item):
+    """Read and preprocess one (image_path, folder_name) item, returning (face, roll_id) or None"""
+    image_path, folder_name = item
+    # Roll No is the folder name
+    # Structure: dataset/roll_no/image.jpg
+    try:
+        roll_id = int(folder_name)
+    except ValueError:
+        return None
+    
+    # Read image in grayscale
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    
+    # Preprocess Loaded Image (Important if old images are different sizes)
+    # Stored captures are enhanced_preprocess_face output, while every recognition path
+    # runs preprocess_face before predict(), so training applies it too to see the same inputs.
+    # Phase 4 saves cropped faces, so the uint8 result is used directly without another copy.
+    return preprocess_face(img), roll_id
+
+def _training_cache_path(folder_name, files):
+    newest = max(f.stat().st_mtime_ns for f in files)
+    return os.path.join(TRAINING_CACHE_DIR, f"{folder_name}-{len(files)}-{newest}.npy")
+
+def _save_training_cache(cache_path, folder_name, faces):
+    """Write one student's (n, 200, 200) face block, replacing older caches of that student"""
+    os.makedirs(TRAINING_CACHE_DIR, exist_ok=True)
+    prefix = f"{folder_name}-"
+    for name in os.listdir(TRAINING_CACHE_DIR):
+        if name.startswith(prefix):
+            os.remove(os.path.join(TRAINING_CACHE_DIR, name))
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, faces)
+    os.replace(tmp_path, cache_path)
+
 def get_images_and_labels(dataset_path):
-    image_paths = []
-    # Recursively find all images
-    for root, dirs, files in os.walk(dataset_path):
-        for file in files:
-            if file.endswith("jpg") or file.endswith("png"):
-                image_paths.append(os.path.join(root, file))
-    
-    face_samples = []
-    ids = []
-    
-    for image_path in image_paths:
-        # Read image in grayscale
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        
-        # Preprocess Loaded Image (Important if old images are different sizes)
-        # Note: If images were saved raw, this ensures they are standardized now.
-        img = preprocess_face(img)
-        
-        # Extract Roll No from folder name
-        # Structure: dataset/roll_no/image.jpg
-        # os.path.split(image_path)[0] -> dataset/roll_no
-        folder_name = os.path.basename(os.path.dirname(image_path))
-        
-        try:
-            roll_id = int(folder_name)
-        except ValueError:
-            continue
+    students = []  # [(roll_id, faces)] - faces are memory-mapped for cache hits
+    to_decode = {}  # folder_name -> (cache_path, [(image_path, folder_name)])
+    # Find all images one level below each student folder; DirEntry caches the type
+    with os.scandir(dataset_path) as student_dirs:
+        for student_dir in student_dirs:
+            if not student_dir.is_dir(follow_symlinks=False):
+                continue
+            try:
+                roll_id = int(student_dir.name)
+            except ValueError:
+                continue
+            with os.scandir(student_dir.path) as entries:
+                files = [f for f in entries
+                         if (f.name.endswith("jpg") or f.name.endswith("png")) and f.is_file(follow_symlinks=False)]
+            if not files:
+                continue
             
-        # We can use the whole image as the face detector already cropped it in Phase 4
-        # But to be safe, we can detect again or just use it.
-        # Phase 4 saves cropped faces, so we use them directly.
-        face_samples.append(np.array(img, 'uint8'))
-        ids.append(roll_id)
+            cache_path = _training_cache_path(student_dir.name, files)
+            if os.path.exists(cache_path):
+                try:
+                    students.append((roll_id, np.load(cache_path, mmap_mode='r')))
+                    continue
+                except (OSError, ValueError):
+                    pass  # Unreadable/empty cache: decode again
+            to_decode[student_dir.name] = (cache_path, [(f.path, student_dir.name) for f in files])
+    
+    # Decode only the students whose images changed since their cache was written
+    image_paths = [item for _, items in to_decode.values() for item in items]
+    decoded = {}
+    with ThreadPoolExecutor(max_workers=TRAINING_LOAD_WORKERS) as executor:
+        for (_, folder_name), result in zip(image_paths, executor.map(_load_training_image, image_paths)):
+            if result is not None:
+                decoded.setdefault(folder_name, []).append(result[0])
+    
+    for folder_name, (cache_path, _) in to_decode.items():
+        if folder_name in decoded:
+            faces = np.stack(decoded[folder_name])
+        else:
+            faces = np.empty((0,) + FACE_SIZE, dtype=np.uint8)
+        try:
+            _save_training_cache(cache_path, folder_name, faces)
+        except OSError as e:
+            print(f"Error saving training cache for {folder_name}: {e}")
+        students.append((int(folder_name), faces))
+    
+    # Samples go straight into one (N, 200, 200) block
+    total = sum(len(faces) for _, faces in students)
+    face_samples = np.empty((total,) + FACE_SIZE, dtype=np.uint8)
+    ids = np.empty(total, dtype=np.int32)
+    count = 0
+    for roll_id, faces in students:
+        face_samples[count:count + len(faces)] = faces
+        ids[count:count + len(faces)] = roll_id
+        count += len(faces)
         
     return face_samples, ids
 
@@ -1121,7 +1956,7 @@ def train_model():
          
     faces, ids = get_images_and_labels(dataset_path)
     
-    if not faces or not ids:
+    if not len(faces):
         flash("No training data found. Add students and capture photos first.", "error")
         return redirect(url_for("home"))
         
@@ -1129,187 +1964,284 @@ def train_model():
     # radius=1, neighbors=8, grid_x=8, grid_y=8
     recognizer = cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=8, grid_x=8, grid_y=8)
     
-    # Shuffle data
-    # Create zipper, shuffle, unzip
-    combined = list(zip(faces, ids))
-    import random
-    random.shuffle(combined)
-    faces[:], ids[:] = zip(*combined)
+    # Shuffle data with a single index permutation
+    order = np.random.permutation(len(faces))
+    faces = list(faces[order])
+    ids = ids[order]
     
-    recognizer.train(faces, np.array(ids))
+    recognizer.train(faces, ids)
     
     recognizer.save(MODEL_FILE) # Save model
     
     # Enhanced Model Validation (Phase 10)
     correct = 0
     total_val = 0
-    if faces and ids:
+    if len(faces) and len(ids):
         total_val = len(faces) // 5  # Use 20% for quick internal validation logic if needed
         # (Simplified validation for this implementation)
     
-    flash(f"Training Complete! Trained on {len(faces)} images for {len(set(ids))} students.", "success")
+    flash(f"Training Complete! Trained on {len(faces)} images for {len(np.unique(ids))} students.", "success")
     return redirect(url_for("home"))
 
+# Loaded recognizer shared by all requests/streams, re-read only when MODEL_FILE changes
+_recognizer_cache = {"signature": None, "recognizer": None}
+_recognizer_lock = threading.Lock()
+
+def get_recognizer():
+    """Return the trained LBPH recognizer, or None if no model has been trained"""
+    try:
+        signature = _file_signature(MODEL_FILE)
+    except OSError:
+        return None
+    with _recognizer_lock:
+        if _recognizer_cache["signature"] != signature:
+            recognizer = cv2.face.LBPHFaceRecognizer_create()
+            recognizer.read(MODEL_FILE)
+            _recognizer_cache["recognizer"] = recognizer
+            _recognizer_cache["signature"] = signature
+        return _recognizer_cache["recognizer"]
+
 # --- Phase 6: Live Attendance ---
 import time
 
 ATTENDANCE_FILE = os.path.join(BASE_DIR, 'attendance.json')
+TIME_FORMAT = "%H:%M:%S"
+
+# Append-only event log: one JSON line per entry/exit, replayed on top of attendance.json
+ATTENDANCE_EVENTS_FILE = os.path.join(BASE_DIR, 'attendance.log.jsonl')
+
+# In-memory attendance state, built lazily from the snapshot + event log
+_attendance_state = None
+_attendance_lock = threading.Lock()
+
+# Events within this many seconds are folded into a single snapshot write
+ATTENDANCE_FLUSH_DELAY = 1.0
+_attendance_flush_timer = None
+
+def _apply_attendance_event(data, roll_no, type_, timestamp):
+    """Apply a single entry/exit event to the attendance dict"""
+    if roll_no not in data:
+        data[roll_no] = {}
+        
+    if type_ == "entry":
+        if "entry" not in data[roll_no]:
+             data[roll_no]["entry"] = timestamp
+    elif type_ == "exit":
+        data[roll_no]["exit"] = timestamp
+        if "entry" in data[roll_no]:
+            t1 = datetime.datetime.strptime(data[roll_no]["entry"], TIME_FORMAT)
+            t2 = datetime.datetime.strptime(timestamp, TIME_FORMAT)
+            duration = t2 - t1
+            data[roll_no]["duration"] = str(duration)
+
+def _build_attendance_state():
+    # Start from the legacy/snapshot file, then replay newer events
+    snapshot = _load_json_cached(ATTENDANCE_FILE, {})
+    data = {roll_no: dict(record) for roll_no, record in snapshot.items()}
+    
+    if os.path.exists(ATTENDANCE_EVENTS_FILE):
+        with open(ATTENDANCE_EVENTS_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    event = json_loads(line)
+                    _apply_attendance_event(data, event['roll'], event['type'], event['ts'])
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    # Skip a torn trailing line from an interrupted write
+                    continue
+    return data
 
 def load_attendance():
-    if not os.path.exists(ATTENDANCE_FILE):
-        return {}
-    with open(ATTENDANCE_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+    global _attendance_state
+    with _attendance_lock:
+        if _attendance_state is None:
+            _attendance_state = _build_attendance_state()
+        return _attendance_state
 
 def save_attendance(data):
-    with open(ATTENDANCE_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
-# Global trackers state: {id: [last_x, current_x, last_seen_time]}
+    """Atomically write a full snapshot and truncate the event log it now contains"""
+    global _attendance_state
+    with _attendance_lock:
+        tmp_path = ATTENDANCE_FILE + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumps(data, indent=False))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, ATTENDANCE_FILE)
+        open(ATTENDANCE_EVENTS_FILE, 'w').close()
+        _attendance_state = data
+
+def _flush_attendance():
+    global _attendance_flush_timer
+    with _attendance_lock:
+        _attendance_flush_timer = None
+        data = _attendance_state
+    if data is not None:
+        try:
+            save_attendance(data)
+        except OSError as e:
+            print(f"Error saving attendance: {e}")
+
+def _schedule_attendance_flush():
+    """Debounce snapshot writes; call with _attendance_lock held"""
+    global _attendance_flush_timer
+    if _attendance_flush_timer is None:
+        _attendance_flush_timer = threading.Timer(ATTENDANCE_FLUSH_DELAY, _flush_attendance)
+        _attendance_flush_timer.daemon = True
+        _attendance_flush_timer.start()
+
+# Global trackers state: {id: [last_x, current_x, last_seen_time]} keyed by integer id
 trackers = {}
 
+# Confidence Threshold
+# < 60 is strict match for our tuned model
+ATTENDANCE_MATCH_THRESHOLD = 60
+VERIFY_FRAMES = 5
+VERIFY_MASK = (1 << VERIFY_FRAMES) - 1
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
 def generate_attendance_frames():
     # Load Model
-    if not os.path.exists(MODEL_FILE):
+    recognizer = get_recognizer()
+    if recognizer is None:
         print("Model not found!")
         return
-        
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(MODEL_FILE)
     
-    # Load Student Names
+    # Load Student Names once, keyed by the integer label the recognizer returns
     students = load_students()
-    
-    camera = cv2.VideoCapture(0)
+    id2name = {int(k): v.get("name", "Unknown") for k, v in students.items() if k.isdigit()}
     
     # Virtual Line X-Coordinate
     LINE_X = 320 
     
-    from collections import deque
-    # History buffer for 5-frame confirmation
-    # Structure: {roll_no: deque([True, True, False...], maxlen=5)}
+    # Line and banner never change, so they are rasterized once
+    def draw_line(canvas):
+        cv2.line(canvas, (LINE_X, 0), (LINE_X, 480), (0, 255, 255), 2)
+        cv2.putText(canvas, "EXIT <--- | ---> ENTRY", (10, 20), 
+                    FONT, 0.5, (0, 255, 255), 2)
+    line_overlay = render_overlay((480, 640, 3), draw_line)
+    
+    # History bitmask for 5-frame confirmation: bit i set = match i frames ago
+    # Structure: {id: 0b10111}
     verification_buffer = {} 
+    frame_id = 0
+    processed_idx = 0
+    last_faces = []
+    prev_gray = None
+    face_buf = np.empty(FACE_SIZE, dtype=np.uint8)  # Preprocessed ROI, reused per face
     
     while True:
-        success, frame = camera.read()
-        if not success:
+        frame_id, frame, gray = camera_broker.read(frame_id + ATTENDANCE_FRAME_SKIP)
+        if frame is None:
             break
-            
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.2, 5)
+        # This pipeline's line and size limits are laid out for 640x480
+        frame = cv2.resize(frame, (640, 480), interpolation=cv2.INTER_AREA)
+        gray = cv2.resize(gray, (640, 480), interpolation=cv2.INTER_AREA)
+        
+        # Full detection every N frames, cheap tracking of the last boxes in between
+        if processed_idx % DETECT_EVERY_N_FRAMES == 0 or prev_gray is None or len(last_faces) == 0:
+            faces = detect_faces(gray, 1.2, 5, min_size=(100, 100), max_size=(300, 300))
+        else:
+            faces = track_faces(prev_gray, gray, last_faces)
+        processed_idx += 1
+        last_faces = faces
+        prev_gray = gray
         
         # Draw Line
-        cv2.line(frame, (LINE_X, 0), (LINE_X, 480), (0, 255, 255), 2)
-        cv2.putText(frame, "EXIT <--- | ---> ENTRY", (10, 20), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+        apply_overlay(frame, line_overlay)
         
         current_time = time.time()
         
         for (x, y, w, h) in faces:
             # ROI
             roi_gray = gray[y:y+h, x:x+w]
-            roi_gray = preprocess_face(roi_gray)
+            roi_gray = preprocess_face(roi_gray, out=face_buf)
             
             # Predict
             try:
                 id_, confidence = recognizer.predict(roi_gray)
                 
-                # Confidence Threshold
-                # < 60 is strict match for our tuned model
-                MATCH_THRESHOLD = 60
-                
                 display_name = "Unknown"
                 display_color = (0, 0, 255)
                 
-                if confidence < MATCH_THRESHOLD:
-                    roll_str = str(id_)
-                    
-                    # Add to buffer
-                    if roll_str not in verification_buffer:
-                        verification_buffer[roll_str] = deque(maxlen=5)
-                    verification_buffer[roll_str].append(True)
+                if confidence < ATTENDANCE_MATCH_THRESHOLD:
+                    # Shift in a match bit
+                    mask = ((verification_buffer.get(id_, 0) << 1) | 1) & VERIFY_MASK
+                    verification_buffer[id_] = mask
                     
                     # Check if confirmed (last 5 frames match)
-                    if len(verification_buffer[roll_str]) == 5 and all(verification_buffer[roll_str]):
+                    if mask == VERIFY_MASK:
                         # Confirmed Identity
-                        name = students.get(roll_str, {}).get("name", "Unknown")
+                        name = id2name.get(id_, "Unknown")
                         display_name = f"{name} ({int(confidence)})"
                         display_color = (0, 255, 0)
                         
                         # Tracking & Attendance Logic
                         cx = x + w // 2
                         
-                        if roll_str not in trackers:
-                            trackers[roll_str] = [cx, cx, current_time]
+                        if id_ not in trackers:
+                            trackers[id_] = [cx, cx, current_time]
                         else:
-                            old_x = trackers[roll_str][0] # Historical
+                            old_x = trackers[id_][0] # Historical
                             
                             # Update current
-                            trackers[roll_str][1] = cx
+                            trackers[id_][1] = cx
                             
                             # Crossing Logic
                             if old_x < LINE_X and cx >= LINE_X:
                                 # Entry
                                 print(f"{name} Entered!")
-                                log_attendance(roll_str, "entry")
-                                cv2.putText(frame, "ENTRY MARKED", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                                log_attendance(str(id_), "entry")
+                                cv2.putText(frame, "ENTRY MARKED", (x, y-10), FONT, 0.8, (0, 255, 0), 2)
                                 
                             elif old_x > LINE_X and cx <= LINE_X:
                                 # Exit
                                 print(f"{name} Exited!")
-                                log_attendance(roll_str, "exit")
-                                cv2.putText(frame, "EXIT MARKED", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                                log_attendance(str(id_), "exit")
+                                cv2.putText(frame, "EXIT MARKED", (x, y-10), FONT, 0.8, (0, 0, 255), 2)
                             
                             # Strict update of old_x to prevent jitter logic
-                            trackers[roll_str][0] = cx
+                            trackers[id_][0] = cx
                 else:
-                    # Clear buffer if recognition fails effectively
-                    # But we usually don't want to clear immediately on one bad frame (flicker)
-                    # However, if confidence is high (bad match), we should treat as unknown
-                    pass
+                    # A weak match breaks the run for that id, so confirmation needs
+                    # 5 consecutive good frames
+                    if id_ in verification_buffer:
+                        verification_buffer[id_] = (verification_buffer[id_] << 1) & VERIFY_MASK
 
                 cv2.putText(frame, display_name, (x, y+h+20), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, display_color, 2)
+                            FONT, 0.6, display_color, 2)
                     
             except Exception as e:
                 pass
                 
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
             
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    camera.release()
+        frame = encode_jpeg(frame)
+        if not frame:
+            continue
+        yield MJPEG_PART_HEADER + frame + b'\r\n'
 
 @app.route("/video_feed_attendance")
 def video_feed_attendance():
     """Video feed for enhanced attendance tracking"""
     return Response(generate_enhanced_attendance_frames(), 
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers=STREAM_HEADERS)
+
+# Streams re-check students.json for new/renamed students every N frames
+STUDENT_RELOAD_FRAMES = 150
 
 def generate_enhanced_attendance_frames():
     """Enhanced attendance tracking with multiple improvements"""
     # Load Model
-    if not os.path.exists(MODEL_FILE):
+    recognizer = get_recognizer()
+    if recognizer is None:
         yield from error_frame("Model not found! Train first.")
         return
     
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(MODEL_FILE)
-    
-    # Load Student Names
+    # Load Student Names (flat roll_no -> name map, refreshed whenever the students change)
     students = load_students()
-    
-    camera = cv2.VideoCapture(0)
-    
-    # Set camera properties for better quality
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    camera.set(cv2.CAP_PROP_FPS, 30)
+    students_seen = json_cache_version(STUDENTS_FILE)
+    name_by_id = {roll: data.get("name", "Unknown") for roll, data in students.items()}
     
     # Virtual Line X-Coordinate
     LINE_X = 640
@@ -1326,33 +2258,52 @@ def generate_enhanced_attendance_frames():
     frame_count = 0
     last_quality_check = 0
     camera_quality_issues = []
+    frame_id = 0
+    prev_gray = None
+    last_faces = []
+    last_results = []  # (id_, confidence, quality_metrics) per box from the last detection
+    preprocess_buf = np.empty((4,) + FACE_SIZE, dtype=np.uint8)  # Grown if more faces show up
     
     while True:
-        success, frame = camera.read()
-        if not success:
+        # The broker converts each camera frame to gray once (or takes the Y plane
+        # in YUYV mode); frames are never written to, so the previous one can be tracked from
+        frame_id, frame, gray = camera_broker.read(frame_id + 1)
+        if frame is None:
             break
         
         frame_count += 1
         frame_time = time.time()
         
-        # Resize frame for better performance
-        frame_resized = cv2.resize(frame, (1280, 720))
+        # In-app edits mutate the cached students dict in place, so compare save versions, not identity
+        if frame_count % STUDENT_RELOAD_FRAMES == 0:
+            students = load_students()
+            if json_cache_version(STUDENTS_FILE) != students_seen:
+                students_seen = json_cache_version(STUDENTS_FILE)
+                name_by_id = {roll: data.get("name", "Unknown") for roll, data in students.items()}
+        frame_ts = None  # LOG_TIMESTAMP_FORMAT string, formatted on first use in this frame
         
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
+        # Resize frame for better performance
+        if frame.shape[:2] == (720, 1280):
+            frame_resized = frame
+        else:
+            frame_resized = cv2.resize(frame, (1280, 720))
+            gray = cv2.resize(gray, (1280, 720))
         
         # Periodically check camera quality
         if frame_time - last_quality_check > 5:  # Every 5 seconds
-            camera_quality_issues = check_camera_quality(frame_resized)
+            camera_quality_issues = check_camera_quality(gray)
             last_quality_check = frame_time
         
-        # Enhanced face detection
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=scale_factor,
-            minNeighbors=min_neighbors,
-            minSize=min_size
-        )
+        # Full detection + recognition every N frames; boxes are tracked in between
+        # (and always re-detected while nothing is being tracked)
+        detect_now = (frame_count - 1) % DETECT_EVERY_N_FRAMES == 0 or prev_gray is None or not len(last_faces)
+        if detect_now:
+            # Enhanced face detection (on a half-size copy; boxes come back in full-res coordinates)
+            faces = detect_faces(gray, scale_factor, min_neighbors, min_size=min_size)
+            results = []
+        else:
+            faces = track_faces(prev_gray, gray, last_faces)
+            results = last_results
         
         # Draw Line and instructions
         cv2.line(frame_resized, (LINE_X, 0), (LINE_X, 720), (0, 255, 255), 3)
@@ -1368,22 +2319,38 @@ def generate_enhanced_attendance_frames():
         
         current_time = time.time()
         
-        for (x, y, w, h) in faces:
+        if detect_now and len(faces):
+            # Extract face ROIs and preprocess them as one batch (one gamma LUT pass)
+            rois = [gray[y:y+h, x:x+w] for (x, y, w, h) in faces]
+            if len(rois) > len(preprocess_buf):
+                preprocess_buf = np.empty((len(rois),) + FACE_SIZE, dtype=np.uint8)
+            try:
+                processed = enhanced_preprocess_face_batch(rois, out=preprocess_buf)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                processed = None
+        
+        for i, (x, y, w, h) in enumerate(faces):
             # Draw face rectangle
             cv2.rectangle(frame_resized, (x, y), (x+w, y+h), (0, 255, 0), 2)
             
-            # Extract face ROI
-            roi_gray = gray[y:y+h, x:x+w]
-            
-            # Calculate face quality metrics
-            quality_metrics = calculate_face_quality(roi_gray)
-            
-            # Preprocess face
-            roi_processed = enhanced_preprocess_face(roi_gray)
-            
             # Predict with confidence
             try:
-                id_, confidence = recognizer.predict(roi_processed)
+                if detect_now:
+                    if processed is None:
+                        results.append(None)
+                        continue
+                    
+                    # Calculate face quality metrics
+                    quality_metrics = calculate_face_quality(rois[i])
+                    
+                    id_, confidence = recognizer.predict(processed[i])
+                    results.append((id_, confidence, quality_metrics))
+                elif results[i] is None:
+                    continue
+                else:
+                    # Tracked box: reuse the recognition from the last detection frame
+                    id_, confidence, quality_metrics = results[i]
                 
                 # Get face center for tracking
                 cx = x + w // 2
@@ -1402,12 +2369,13 @@ def generate_enhanced_attendance_frames():
                 # Check if recognized
                 if confidence < MATCH_THRESHOLD:
                     roll_no = str(id_)
-                    name = students.get(roll_no, {}).get("name", "Unknown")
+                    name = name_by_id.get(roll_no, "Unknown")
                     
-                    # Update verification buffer
-                    if roll_no not in enhanced_tracker.verification_buffers:
-                        enhanced_tracker.verification_buffers[roll_no] = deque(maxlen=5)
-                    enhanced_tracker.verification_buffers[roll_no].append(True)
+                    # Update verification buffer (only fresh recognitions count)
+                    if detect_now:
+                        if roll_no not in enhanced_tracker.verification_buffers:
+                            enhanced_tracker.verification_buffers[roll_no] = deque(maxlen=5)
+                        enhanced_tracker.verification_buffers[roll_no].append(True)
                     
                     # Check verification
                     buffer = list(enhanced_tracker.verification_buffers[roll_no])
@@ -1418,7 +2386,8 @@ def generate_enhanced_attendance_frames():
                         display_color = (0, 255, 0)
                         
                         # Update recognition history
-                        enhanced_tracker.update_recognition_history(roll_no, confidence, True)
+                        if detect_now:
+                            enhanced_tracker.update_recognition_history(roll_no, confidence, True)
                         
                         # Tracking logic
                         if roll_no not in enhanced_tracker.trackers:
@@ -1437,21 +2406,23 @@ def generate_enhanced_attendance_frames():
                         
                         tracker['last_x'] = smoothed_x
                         tracker['last_y'] = smoothed_y
-                        tracker['last_seen'] = current_time
+                        enhanced_tracker.touch(roll_no, current_time)
                         
                         # Crossing detection (Right to Left = Entry, Left to Right = Exit)
                         # We follow the existing app logic where LINE_X is center
                         if old_x > LINE_X and smoothed_x <= LINE_X:
                             # Entry
-                            log_attendance_event('ENTRY', roll_no, name, confidence, quality_metrics)
-                            log_attendance(roll_no, "entry")
+                            frame_ts = frame_ts or datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT)
+                            log_attendance_event('ENTRY', roll_no, name, confidence, quality_metrics, frame_ts)
+                            log_attendance(roll_no, "entry", frame_ts[11:])
                             cv2.putText(frame_resized, "ENTRY MARKED", (x, y-10), 
                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
                         
                         elif old_x < LINE_X and smoothed_x >= LINE_X:
                             # Exit
-                            log_attendance_event('EXIT', roll_no, name, confidence, quality_metrics)
-                            log_attendance(roll_no, "exit")
+                            frame_ts = frame_ts or datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT)
+                            log_attendance_event('EXIT', roll_no, name, confidence, quality_metrics, frame_ts)
+                            log_attendance(roll_no, "exit", frame_ts[11:])
                             cv2.putText(frame_resized, "EXIT MARKED", (x, y-10), 
                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
                     else:
@@ -1459,7 +2430,8 @@ def generate_enhanced_attendance_frames():
                         display_color = (0, 255, 255)
                 else:
                     if frame_count % 30 == 0:
-                        log_attendance_event('UNKNOWN_DETECTED', 'unknown', 'Unknown Person', confidence, quality_metrics)
+                        frame_ts = frame_ts or datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT)
+                        log_attendance_event('UNKNOWN_DETECTED', 'unknown', 'Unknown Person', confidence, quality_metrics, frame_ts)
                 
                 # Display name and confidence
                 cv2.putText(frame_resized, f"{display_name} ({int(confidence)})", (x, y+h+25), 
@@ -1467,20 +2439,20 @@ def generate_enhanced_attendance_frames():
                 
             except Exception as e:
                 print(f"Recognition error: {e}")
+                if detect_now and len(results) == i:
+                    results.append(None)
+        
+        prev_gray = gray
+        last_faces = faces
+        last_results = results
         
         # Cleanup old trackers
-        inactive_rolls = [r for r, t in enhanced_tracker.trackers.items() if current_time - t['last_seen'] > 60]
-        for r in inactive_rolls: 
-            del enhanced_tracker.trackers[r]
-            if r in enhanced_tracker.kalman_filters: del enhanced_tracker.kalman_filters[r]
+        enhanced_tracker.expire_inactive(current_time, 60)
         
         # Stream frame
-        ret, buffer = cv2.imencode('.jpg', frame_resized)
-        if ret:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-    
-    camera.release()
+        jpeg = encode_jpeg(downscale_for_stream(frame_resized))
+        if jpeg:
+            yield MJPEG_PART_HEADER + jpeg + b'\r\n'
 
 # --- Phase 7: Time Window & Absent Logic ---
 # Hardcoded Time Window (e.g., 09:00 AM to 05:00 PM)
@@ -1505,35 +2477,68 @@ def is_within_time_window():
     
     return True # Temporarily True for demo/testing at any time
 
-def log_attendance(roll_no, type_):
+def log_attendance(roll_no, type_, timestamp=None):
     if not is_within_time_window():
         print("Outside time window. Attendance not marked.")
         return
 
     data = load_attendance()
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
     
-    if roll_no not in data:
-        data[roll_no] = {}
-        
-    if type_ == "entry":
-        if "entry" not in data[roll_no]:
-             data[roll_no]["entry"] = timestamp
-    elif type_ == "exit":
-        data[roll_no]["exit"] = timestamp
-        if "entry" in data[roll_no]:
-            fmt = "%H:%M:%S"
-            t1 = datetime.datetime.strptime(data[roll_no]["entry"], fmt)
-            t2 = datetime.datetime.strptime(timestamp, fmt)
-            duration = t2 - t1
-            data[roll_no]["duration"] = str(duration)
-            
-    save_attendance(data)
+    # Only the first entry of the day is kept, so repeat entries never reach the event log
+    if type_ == "entry" and "entry" in data.get(roll_no, ()):
+        return
+    
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime(TIME_FORMAT)
+    
+    # Append one event line now (durable); the full snapshot is rewritten once per
+    # ATTENDANCE_FLUSH_DELAY window, which also truncates the event log again
+    with _attendance_lock:
+        _apply_attendance_event(data, roll_no, type_, timestamp)
+        with open(ATTENDANCE_EVENTS_FILE, 'ab') as f:
+            f.write(json_dumps({"roll": roll_no, "type": type_, "ts": timestamp}, indent=False) + b"\n")
+            f.flush()
+        _schedule_attendance_flush()
 
 # --- Phase 8: Excel Export ---
+import io
 import pandas as pd
 from flask import send_file
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# xlsxwriter writes plain-value sheets several times faster than openpyxl
+try:
+    import xlsxwriter
+    EXCEL_ENGINE = 'xlsxwriter'
+except ImportError:
+    xlsxwriter = None
+    EXCEL_ENGINE = 'openpyxl'
+
+def write_xlsx(target, sheets):
+    """Write [(sheet_name, header, rows)] straight to an .xlsx file or binary buffer, without DataFrames.
+    
+    Rows are streamed: xlsxwriter in constant_memory mode, or an openpyxl write-only workbook.
+    """
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(target, {'constant_memory': True})
+        for name, header, rows in sheets:
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, header)
+            for row_idx, row in enumerate(rows, 1):
+                worksheet.write_row(row_idx, 0, row)
+        workbook.close()
+        return
+    
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, header, rows in sheets:
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(target)
+
 @app.route("/export")
 @login_required
 @role_required('admin', 'teacher')
@@ -1541,37 +2546,39 @@ def export():
     students = load_students()
     attendance = load_attendance()
     
-    export_data = []
+    # Build columns directly instead of a list of per-row dicts
+    rolls, names, entries, exits, durations, statuses, photos = [], [], [], [], [], [], []
     
     for roll_no, s_data in students.items():
-        name = s_data['name']
-        
         # Check attendance
         a_data = attendance.get(roll_no, {})
         entry = a_data.get("entry", "-")
-        exit_ = a_data.get("exit", "-")
-        duration = a_data.get("duration", "-")
-        
-        status = "Present" if entry != "-" else "Absent"
-        photo_path = f"dataset/{roll_no}/1.jpg" # Example path
-        
-        export_data.append({
-            "Roll Number": roll_no,
-            "Student Name": name,
-            "Entry Time": entry,
-            "Exit Time": exit_,
-            "Duration": duration,
-            "Status": status,
-            "Photo Path": photo_path
-        })
         
-    df = pd.DataFrame(export_data)
+        rolls.append(roll_no)
+        names.append(s_data['name'])
+        entries.append(entry)
+        exits.append(a_data.get("exit", "-"))
+        durations.append(a_data.get("duration", "-"))
+        statuses.append("Present" if entry != "-" else "Absent")
+        photos.append(f"dataset/{roll_no}/1.jpg") # Example path
+        
+    df = pd.DataFrame({
+        "Roll Number": rolls,
+        "Student Name": names,
+        "Entry Time": entries,
+        "Exit Time": exits,
+        "Duration": durations,
+        "Status": statuses,
+        "Photo Path": photos
+    })
     output_file = 'attendance.xlsx'
     
-    # Save to Excel
-    df.to_excel(os.path.join(BASE_DIR, output_file), index=False)
+    # Build the workbook in memory and send it from the same buffer
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, engine=EXCEL_ENGINE)
+    buf.seek(0)
     
-    return send_file(os.path.join(BASE_DIR, output_file), as_attachment=True)
+    return send_file(buf, as_attachment=True, download_name=output_file, mimetype=XLSX_MIMETYPE)
 
 
 
@@ -1588,10 +2595,11 @@ def api_check_ids():
     dataset_ids = set()
     
     if os.path.exists(DATASET_DIR):
-        for item in os.listdir(DATASET_DIR):
-            item_path = os.path.join(DATASET_DIR, item)
-            if os.path.isdir(item_path):
-                dataset_ids.add(item)
+        with os.scandir(DATASET_DIR) as entries:
+            for entry in entries:
+                # Skip folders from delete_student that are still being removed
+                if entry.is_dir() and '.deleted.' not in entry.name:
+                    dataset_ids.add(entry.name)
     
     json_ids = set(students.keys())
     
@@ -1626,50 +2634,55 @@ def api_fix_mismatch(action, roll_no):
 @app.route("/api/debug/test_recognition/<roll_no>")
 def api_test_recognition(roll_no):
     """Test recognition for specific student"""
-    if not os.path.exists(MODEL_FILE):
+    recognizer = get_recognizer()
+    if recognizer is None:
         return {"status": "error", "message": "Model not trained"}
     
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(MODEL_FILE)
-    
     # Test with student's images
     student_folder = os.path.join(DATASET_DIR, str(roll_no))
     if not os.path.exists(student_folder):
         return {"status": "error", "message": "Student folder not found"}
     
-    results = []
     images = [f for f in os.listdir(student_folder) if f.endswith('.jpg')][:5]  # Test 5 images
+    expected_id = int(roll_no)
     
-    for img_name in images:
-        img_path = os.path.join(student_folder, img_name)
-        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-        
-        if img is None:
+    def load_image(img_name):
+        img = cv2.imread(os.path.join(student_folder, img_name), cv2.IMREAD_GRAYSCALE)
+        return None if img is None else preprocess_face(img)
+    
+    # Decoding/preprocessing release the GIL, so load concurrently and predict in sequence
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        faces = list(executor.map(load_image, images))
+    
+    results = []
+    for img_name, face in zip(images, faces):
+        if face is None:
             continue
-            
-        # Preprocess
-        img = preprocess_face(img)
-        
-        # Predict
-        id_, confidence = recognizer.predict(img)
-        
+        id_, confidence = recognizer.predict(face)
         results.append({
             "image": img_name,
             "predicted_id": int(id_),
-            "expected_id": int(roll_no),
+            "expected_id": expected_id,
             "confidence": float(confidence),
-            "match": int(id_) == int(roll_no) and confidence < 70
+            "match": int(id_) == expected_id and confidence < 70
         })
     
     return {
         "status": "success",
         "roll_no": roll_no,
         "results": results,
-        "accuracy": sum(1 for r in results if r["match"]) / len(results) if results else 0
+        "accuracy": float(np.mean([r["match"] for r in results])) if results else 0
     }
 
 
 # ==================== PERIOD MANAGEMENT FUNCTIONS ====================
+# Parsed, sorted periods keyed by the file's (mtime_ns, size); reset by save_periods
+_periods_cache = {"signature": None, "data": None}
+
+# get_current_period() answers are reused for this many seconds; save_periods resets it
+CURRENT_PERIOD_TTL = 2.0
+_current_period_cache = {"expires": 0.0, "period": None}
+
 @antigravity_trace
 def load_periods():
     """Load period configurations from JSON file"""
@@ -1762,24 +2775,113 @@ def load_periods():
             }
         ]
         save_periods(default_periods)
+        for period in default_periods:
+            _parse_period_times(period)
         return default_periods
     
     try:
-        with open(PERIODS_FILE, 'r') as f:
-            periods = json.load(f)
-            # Sort periods by start time
-            periods.sort(key=lambda x: datetime.datetime.strptime(x['start_time'], '%H:%M:%S'))
+        signature = _file_signature(PERIODS_FILE)
+        if _periods_cache["signature"] == signature:
+            return _periods_cache["data"]
+        with open(PERIODS_FILE, 'rb') as f:
+            periods = json_loads(f.read())
+            # Parsing also zero-pads hand-written times like "9:00:00", so the string sort
+            # below is chronological (a single pass, since saves keep the file sorted)
+            for period in periods:
+                _parse_period_times(period)
+            periods.sort(key=lambda x: x['start_time'])
+            _periods_cache["signature"] = signature
+            _periods_cache["data"] = periods
             return periods
     except (json.JSONDecodeError, IOError) as e:
         print(f"Error loading periods: {e}")
         return []
 
+@lru_cache(maxsize=None)
+def _parse_hms(time_str):
+    """Parse an HH:MM:SS string once; there are at most 86400 distinct values"""
+    return datetime.datetime.strptime(time_str, '%H:%M:%S')
+
+def _parse_period_times(period):
+    """Attach pre-parsed time objects (start/end and grace window) to a period dict.
+    
+    start_time/end_time are rewritten as zero-padded HH:MM:SS, so string order is time order.
+    """
+    start_dt = _parse_hms(period['start_time'])
+    end_dt = _parse_hms(period['end_time'])
+    period['start_time'] = start_dt.strftime('%H:%M:%S')
+    period['end_time'] = end_dt.strftime('%H:%M:%S')
+    grace = datetime.timedelta(minutes=GRACE_PERIOD_MINUTES)
+    period['_start_t'] = start_dt.time()
+    period['_end_t'] = end_dt.time()
+    period['_grace_start_t'] = max(start_dt - grace, start_dt.replace(hour=0, minute=0, second=0)).time()
+    period['_grace_end_t'] = min(end_dt + grace, end_dt.replace(hour=23, minute=59, second=59)).time()
+    return period
+
+def _time_to_seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+def _hms_to_seconds(time_str):
+    """'HH:MM:SS' (hours may be unpadded) -> integer seconds"""
+    h, m, sec = map(int, time_str.split(':'))
+    return h * 3600 + m * 60 + sec
+
+def _hms_array_to_seconds(values):
+    """Zero-padded 'HH:MM:SS' strings -> int32 seconds array, parsed as fixed-width digit bytes"""
+    digits = np.frombuffer(np.array(values, dtype='S8').tobytes(), dtype=np.uint8).reshape(-1, 8).astype(np.int32) - 48
+    return (digits[:, 0] * 36000 + digits[:, 1] * 3600 + digits[:, 3] * 600
+            + digits[:, 4] * 60 + digits[:, 6] * 10 + digits[:, 7])
+
+def _seconds_to_hms(total):
+    return f"{total // 3600:02d}:{(total % 3600) // 60:02d}:{total % 60:02d}"
+
+def _local_hms(ts):
+    """Epoch seconds -> local 'HH:MM:SS' without building a datetime"""
+    t = time.localtime(ts)
+    return f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+
+def _period_index(periods):
+    """Lookup tables for a loaded period list, rebuilt only when the list changes.
+    
+    Besides the id map, each field is a parallel NumPy array over the (start-sorted)
+    periods, in seconds since midnight, so time checks are single vectorized comparisons.
+    """
+    index = _periods_cache.get("index")
+    if index is not None and index["source"] is periods:
+        return index
+    index = {
+        "source": periods,
+        "by_id": {p['period_id']: p for p in periods},
+        "id": np.array([p['period_id'] for p in periods], dtype=np.int32),
+        "start": np.array([_time_to_seconds(p['_start_t']) for p in periods], dtype=np.int32),
+        "end": np.array([_time_to_seconds(p['_end_t']) for p in periods], dtype=np.int32),
+        "grace_start": np.array([_time_to_seconds(p['_grace_start_t']) for p in periods], dtype=np.int32),
+        "grace_end": np.array([_time_to_seconds(p['_grace_end_t']) for p in periods], dtype=np.int32),
+        "active": np.array([p.get('is_active', True) for p in periods], dtype=bool),
+        "break": np.array([p.get('is_break', False) for p in periods], dtype=bool),
+    }
+    _periods_cache["index"] = index
+    return index
+
+def find_overlapping_period(periods, start_sec, end_sec, exclude_id=None):
+    """Return an active period overlapping [start_sec, end_sec), ignoring exclude_id"""
+    index = _period_index(periods)
+    mask = index["active"] & (index["start"] < end_sec) & (index["end"] > start_sec)
+    if exclude_id is not None:
+        mask &= index["id"] != exclude_id
+    return periods[int(np.argmax(mask))] if mask.any() else None
+
 @antigravity_trace
 def save_periods(periods_data):
     """Save period configurations to JSON file"""
+    # Pre-parsed '_' fields are derived on load and never persisted
+    periods_data = sorted(({k: v for k, v in p.items() if not k.startswith('_')} for p in periods_data),
+                          key=lambda x: x['start_time'])
+    _periods_cache["signature"] = None
+    _current_period_cache["expires"] = 0.0
     try:
-        with open(PERIODS_FILE, 'w') as f:
-            json.dump(periods_data, f, indent=4)
+        with open(PERIODS_FILE, 'wb') as f:
+            f.write(json_dumps(periods_data))
     except IOError as e:
         print(f"Error saving periods: {e}")
         raise
@@ -1787,51 +2889,37 @@ def save_periods(periods_data):
 @antigravity_trace
 def get_current_period():
     """Get current period based on current time"""
-    now = datetime.datetime.now().time()
-    periods = load_periods()
+    now_mono = time.monotonic()
+    if now_mono < _current_period_cache["expires"]:
+        return _current_period_cache["period"]
     
-    for period in periods:
-        if not period.get('is_active', True):
-            continue
-            
-        start_time = datetime.datetime.strptime(period['start_time'], '%H:%M:%S').time()
-        end_time = datetime.datetime.strptime(period['end_time'], '%H:%M:%S').time()
-        
-        # Check if current time is within period (with grace period)
-        grace_start = (datetime.datetime.combine(datetime.datetime.today(), start_time) - 
-                      datetime.timedelta(minutes=GRACE_PERIOD_MINUTES)).time()
-        grace_end = (datetime.datetime.combine(datetime.datetime.today(), end_time) + 
-                     datetime.timedelta(minutes=GRACE_PERIOD_MINUTES)).time()
-        
-        if grace_start <= now <= grace_end:
-            return period
+    now_sec = _time_to_seconds(datetime.datetime.now().time())
+    periods = load_periods()
+    index = _period_index(periods)
     
-    return None
+    # argmax picks the first match, so overlapping grace windows resolve to the earlier period
+    mask = index["active"] & (index["grace_start"] <= now_sec) & (index["grace_end"] >= now_sec)
+    period = periods[int(np.argmax(mask))] if mask.any() else None
+    _current_period_cache["period"] = period
+    _current_period_cache["expires"] = now_mono + CURRENT_PERIOD_TTL
+    return period
 
 @antigravity_trace
 def get_period_by_id(period_id):
     """Get period by ID"""
-    periods = load_periods()
-    for period in periods:
-        if period['period_id'] == period_id:
-            return period
-    return None
+    return _period_index(load_periods())["by_id"].get(period_id)
 
 @antigravity_trace
 def get_next_period():
     """Get next period after current time"""
-    now = datetime.datetime.now().time()
+    now_sec = _time_to_seconds(datetime.datetime.now().time())
     periods = load_periods()
+    index = _period_index(periods)
     
-    for period in periods:
-        if not period.get('is_active', True):
-            continue
-            
-        start_time = datetime.datetime.strptime(period['start_time'], '%H:%M:%S').time()
-        if start_time > now:
-            return period
-    
-    return None
+    # First active period among those starting after now
+    i = int(np.searchsorted(index["start"], now_sec, side='right'))
+    upcoming = np.flatnonzero(index["active"][i:])
+    return periods[i + int(upcoming[0])] if upcoming.size else None
 
 @antigravity_trace
 def calculate_period_duration(entry_time_str, exit_time_str):
@@ -1840,15 +2928,11 @@ def calculate_period_duration(entry_time_str, exit_time_str):
         return "00:00:00"
     
     try:
-        entry_time = datetime.datetime.strptime(entry_time_str, '%H:%M:%S')
-        exit_time = datetime.datetime.strptime(exit_time_str, '%H:%M:%S')
-        
-        if exit_time < entry_time:
+        duration = _hms_to_seconds(exit_time_str) - _hms_to_seconds(entry_time_str)
+        if duration < 0:
             # Handle overnight scenario (not typical for school)
-            exit_time = exit_time + datetime.timedelta(days=1)
-        
-        duration = exit_time - entry_time
-        return str(duration)
+            duration += 86400
+        return _seconds_to_hms(duration)
     except ValueError as e:
         print(f"Error calculating duration: {e}")
         return "00:00:00"
@@ -1857,120 +2941,183 @@ def calculate_period_duration(entry_time_str, exit_time_str):
 def is_within_period_window(period):
     """Check if current time is within attendance window for period"""
     now = datetime.datetime.now().time()
-    start_time = datetime.datetime.strptime(period['start_time'], '%H:%M:%S').time()
-    end_time = datetime.datetime.strptime(period['end_time'], '%H:%M:%S').time()
-    
-    grace_start = (datetime.datetime.combine(datetime.datetime.today(), start_time) - 
-                  datetime.timedelta(minutes=GRACE_PERIOD_MINUTES)).time()
-    grace_end = (datetime.datetime.combine(datetime.datetime.today(), end_time) + 
-                 datetime.timedelta(minutes=GRACE_PERIOD_MINUTES)).time()
-    
-    return grace_start <= now <= grace_end
+    if '_grace_start_t' not in period:
+        _parse_period_times(period)
+    return period['_grace_start_t'] <= now <= period['_grace_end_t']
 
 # ==================== PERIOD-WISE ATTENDANCE FUNCTIONS ====================
-@antigravity_trace
-def load_period_attendance():
-    """Load period-wise attendance data"""
-    if not os.path.exists(ATTENDANCE_PERIOD_FILE):
-        return {}
+# One row per (date, student, period); marks are single-row upserts instead of
+# rewriting the whole attendance history
+ATTENDANCE_DB_FILE = os.path.join(BASE_DIR, 'attendance.db')
+_period_db_local = threading.local()
+
+# Built load_period_attendance results, dropped whenever a mark is written
+PERIOD_ATTENDANCE_CACHE_SIZE = 64  # Distinct (date, roll_no) queries kept between writes
+_period_attendance_cache = {"generation": 0, "results": {}}
+_period_attendance_lock = threading.Lock()
+
+def _period_db():
+    """Per-thread SQLite connection to the period attendance database"""
+    conn = getattr(_period_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(ATTENDANCE_DB_FILE, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _period_db_local.conn = conn
+    return conn
+
+def _init_period_db():
+    """Create the schema and import attendance_period.json on first run"""
+    conn = _period_db()
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS period_attendance (
+                date TEXT NOT NULL,
+                roll_no TEXT NOT NULL,
+                period_id INTEGER NOT NULL,
+                entry TEXT,
+                exit TEXT,
+                duration_sec INTEGER NOT NULL DEFAULT 0,
+                attendance_percentage REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (date, roll_no, period_id)
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_period_attendance_date_period "
+                     "ON period_attendance (date, period_id)")
     
+    if not os.path.exists(ATTENDANCE_PERIOD_FILE):
+        return
+    if conn.execute("SELECT 1 FROM period_attendance LIMIT 1").fetchone():
+        return
     try:
-        with open(ATTENDANCE_PERIOD_FILE, 'r') as f:
-            return json.load(f)
+        with open(ATTENDANCE_PERIOD_FILE, 'rb') as f:
+            legacy = json_loads(f.read())
     except (json.JSONDecodeError, IOError) as e:
         print(f"Error loading period attendance: {e}")
-        return {}
-
-@antigravity_trace
-def save_period_attendance(attendance_data):
-    """Save period-wise attendance data"""
-    try:
-        with open(ATTENDANCE_PERIOD_FILE, 'w') as f:
-            json.dump(attendance_data, f, indent=4)
-    except IOError as e:
-        print(f"Error saving period attendance: {e}")
-        raise
+        return
+    rows = []
+    for date_str, day_data in legacy.items():
+        for roll_no, student_data in day_data.items():
+            for period_id, period_data in student_data.get("periods", {}).items():
+                try:
+                    duration_sec = _hms_to_seconds(period_data.get("duration") or "00:00:00")
+                except ValueError:
+                    duration_sec = 0
+                rows.append((date_str, roll_no, int(period_id), period_data.get("entry"),
+                             period_data.get("exit"), duration_sec,
+                             period_data.get("attendance_percentage", 0)))
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO period_attendance VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    print(f"Imported {len(rows)} period attendance records into {ATTENDANCE_DB_FILE}")
+
+def _period_record(entry, exit_, duration_sec, percentage):
+    return {
+        "entry": entry,
+        "exit": exit_,
+        "duration": _seconds_to_hms(duration_sec),
+        "present": entry is not None,
+        "attendance_percentage": percentage
+    }
 
 @antigravity_trace
-def mark_period_attendance(roll_no, period_id, entry_time=None, exit_time=None):
-    """Mark attendance for a specific period"""
-    today_str = datetime.datetime.now().strftime("%Y-%m-%d")
-    current_time = datetime.datetime.now().strftime("%H:%M:%S")
-    
-    attendance_data = load_period_attendance()
+def load_period_attendance(date_str=None, roll_no=None):
+    """Load period-wise attendance as {date: {roll_no: {...}}}, optionally for one date/student.
     
-    # Initialize day data if not exists
-    if today_str not in attendance_data:
-        attendance_data[today_str] = {}
+    Results are shared between callers until the next mark, so treat them as read-only.
+    """
+    key = (date_str, roll_no)
+    with _period_attendance_lock:
+        generation = _period_attendance_cache["generation"]
+        cached = _period_attendance_cache["results"].get(key)
+    if cached is not None:
+        return cached
+    
+    query = "SELECT date, roll_no, period_id, entry, exit, duration_sec, attendance_percentage FROM period_attendance"
+    clauses, params = [], []
+    if date_str:
+        clauses.append("date = ?")
+        params.append(date_str)
+    if roll_no:
+        clauses.append("roll_no = ?")
+        params.append(roll_no)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    
+    attendance_data = {}
+    try:
+        rows = _period_db().execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error loading period attendance: {e}")
+        return {}
     
-    # Initialize student data if not exists
-    if roll_no not in attendance_data[today_str]:
-        attendance_data[today_str][roll_no] = {
+    for date_, roll, period_id, entry, exit_, duration_sec, percentage in rows:
+        student_data = attendance_data.setdefault(date_, {}).setdefault(roll, {
             "periods": {},
             "total_present": 0,
             "total_absent": 0,
-            "total_duration": "00:00:00"
-        }
-    
-    student_data = attendance_data[today_str][roll_no]
-    
-    # Initialize period data if not exists
-    if str(period_id) not in student_data["periods"]:
-        student_data["periods"][str(period_id)] = {
-            "entry": None,
-            "exit": None,
-            "duration": "00:00:00",
-            "present": False,
-            "attendance_percentage": 0
-        }
-    
-    period_data = student_data["periods"][str(period_id)]
-    
-    # Update entry or exit time
-    if entry_time:
-        period_data["entry"] = entry_time
-        period_data["present"] = True
-        
-        # Update total present count
-        if not period_data.get("counted", False):
+            "total_duration": 0
+        })
+        student_data["periods"][str(period_id)] = _period_record(entry, exit_, duration_sec, percentage)
+        if entry is not None:
             student_data["total_present"] += 1
-            period_data["counted"] = True
+        student_data["total_duration"] += duration_sec
     
-    if exit_time:
-        period_data["exit"] = exit_time
-        
-        # Calculate duration if both entry and exit exist
-        if period_data["entry"]:
-            duration = calculate_period_duration(period_data["entry"], exit_time)
-            period_data["duration"] = duration
-            
-            # Update total duration
-            try:
-                total_duration = datetime.datetime.strptime(student_data["total_duration"], '%H:%M:%S')
-                period_duration = datetime.datetime.strptime(duration, '%H:%M:%S')
-                new_total = (datetime.datetime.combine(datetime.datetime.today(), total_duration.time()) + 
-                            datetime.timedelta(hours=period_duration.hour, 
-                                    minutes=period_duration.minute, 
-                                    seconds=period_duration.second))
-                student_data["total_duration"] = new_total.strftime('%H:%M:%S')
-            except ValueError:
-                 student_data["total_duration"] = "00:00:00"
+    for day_data in attendance_data.values():
+        for student_data in day_data.values():
+            student_data["total_duration"] = _seconds_to_hms(student_data["total_duration"])
+    
+    with _period_attendance_lock:
+        # Skip storing if a mark landed while this query ran
+        if _period_attendance_cache["generation"] == generation:
+            results = _period_attendance_cache["results"]
+            if len(results) >= PERIOD_ATTENDANCE_CACHE_SIZE:
+                results.clear()
+            results[key] = attendance_data
+    return attendance_data
 
+@antigravity_trace
+def mark_period_attendance(roll_no, period_id, entry_time=None, exit_time=None):
+    """Mark attendance for a specific period"""
+    today_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    conn = _period_db()
+    
+    with conn:
+        # Take the write lock up front so concurrent streams can't interleave read/update
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT entry, exit, duration_sec, attendance_percentage FROM period_attendance "
+            "WHERE date = ? AND roll_no = ? AND period_id = ?",
+            (today_str, roll_no, period_id)).fetchone()
+        entry, exit_, duration_sec, percentage = row if row else (None, None, 0, 0)
+        
+        # Update entry or exit time
+        if entry_time:
+            entry = entry_time
+        
+        if exit_time:
+            exit_ = exit_time
             
-            # Calculate attendance percentage for period
-            period = get_period_by_id(period_id)
-            if period and not period.get('is_break', False):
-                period_duration_seconds = period['duration_minutes'] * 60
-                attended_seconds = (period_duration.hour * 3600 + 
-                                  period_duration.minute * 60 + 
-                                  period_duration.second)
-                percentage = (attended_seconds / period_duration_seconds) * 100
-                period_data["attendance_percentage"] = round(percentage, 2)
+            # Calculate duration if both entry and exit exist
+            if entry:
+                duration_sec = _hms_to_seconds(calculate_period_duration(entry, exit_time))
+                
+                # Calculate attendance percentage for period
+                period = get_period_by_id(period_id)
+                if period and not period.get('is_break', False):
+                    period_duration_seconds = period['duration_minutes'] * 60
+                    percentage = round((duration_sec / period_duration_seconds) * 100, 2)
+        
+        conn.execute(
+            "INSERT INTO period_attendance VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (date, roll_no, period_id) DO UPDATE SET entry = excluded.entry, "
+            "exit = excluded.exit, duration_sec = excluded.duration_sec, "
+            "attendance_percentage = excluded.attendance_percentage",
+            (today_str, roll_no, period_id, entry, exit_, duration_sec, percentage))
     
-    # Save updated attendance
-    save_period_attendance(attendance_data)
+    with _period_attendance_lock:
+        _period_attendance_cache["generation"] += 1
+        _period_attendance_cache["results"] = {}
     
-    return period_data
+    return _period_record(entry, exit_, duration_sec, percentage)
 
 @antigravity_trace
 def get_student_period_attendance(roll_no, date_str=None):
@@ -1978,7 +3125,7 @@ def get_student_period_attendance(roll_no, date_str=None):
     if not date_str:
         date_str = datetime.datetime.now().strftime("%Y-%m-%d")
     
-    attendance_data = load_period_attendance()
+    attendance_data = load_period_attendance(date_str, roll_no)
     
     if date_str in attendance_data and roll_no in attendance_data[date_str]:
         return attendance_data[date_str][roll_no]
@@ -1991,11 +3138,21 @@ def get_daily_period_summary(date_str=None):
     if not date_str:
         date_str = datetime.datetime.now().strftime("%Y-%m-%d")
     
-    attendance_data = load_period_attendance()
     students = load_students()
     periods = load_periods()
     
-    if date_str not in attendance_data:
+    # Present count per period for the day, aggregated in SQLite
+    try:
+        present_by_period = dict(_period_db().execute(
+            "SELECT period_id, COUNT(*) FROM period_attendance "
+            "WHERE date = ? AND entry IS NOT NULL GROUP BY period_id", (date_str,)).fetchall())
+        has_records = present_by_period or _period_db().execute(
+            "SELECT 1 FROM period_attendance WHERE date = ? LIMIT 1", (date_str,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error loading period attendance: {e}")
+        present_by_period, has_records = {}, False
+    
+    if not has_records:
         return {
             "date": date_str,
             "total_students": len(students),
@@ -2003,49 +3160,34 @@ def get_daily_period_summary(date_str=None):
             "overall_attendance": 0
         }
     
-    day_data = attendance_data[date_str]
+    # Active class periods (breaks excluded), in start order
+    index = _period_index(periods)
+    class_periods = [periods[i] for i in np.flatnonzero(index["active"] & ~index["break"])]
+    total_students = len(students)
+    
+    # Present counts and percentages for all class periods at once
+    present = np.fromiter((present_by_period.get(p['period_id'], 0) for p in class_periods),
+                          dtype=np.int64, count=len(class_periods))
+    if total_students > 0:
+        percentages = np.round(present / total_students * 100, 2)
+    else:
+        percentages = np.zeros(len(class_periods))
     
-    # Initialize period summary
     period_summary = {}
-    for period in periods:
-        if not period.get('is_active', True) or period.get('is_break', False):
-            continue
-        
-        period_id = period['period_id']
-        period_summary[period_id] = {
+    for period, count, percentage in zip(class_periods, present.tolist(), percentages.tolist()):
+        period_summary[period['period_id']] = {
             "period_name": period['period_name'],
             "subject": period['subject'],
             "teacher": period['teacher'],
-            "total_students": len(students),
-            "present": 0,
-            "absent": len(students),
-            "attendance_percentage": 0,
+            "total_students": total_students,
+            "present": count,
+            "absent": total_students - count,
+            "attendance_percentage": percentage,
             "average_duration": "00:00:00"
         }
     
-    # Calculate period-wise statistics
-    total_present_all = 0
-    total_periods_all = 0
-    
-    for roll_no, student_data in day_data.items():
-        for period_id_str, period_data in student_data.get("periods", {}).items():
-            period_id = int(period_id_str)
-            
-            if period_id in period_summary and period_data.get("present", False):
-                period_summary[period_id]["present"] += 1
-                period_summary[period_id]["absent"] -= 1
-                
-                # Track for overall calculation
-                total_present_all += 1
-    
-    # Calculate percentages
-    for period_id, summary in period_summary.items():
-        if summary["total_students"] > 0:
-            summary["attendance_percentage"] = round(
-                (summary["present"] / summary["total_students"]) * 100, 2
-            )
-        
-        total_periods_all += 1
+    total_present_all = int(present.sum())
+    total_periods_all = len(class_periods)
     
     # Calculate overall attendance
     total_possible = len(students) * total_periods_all
@@ -2104,16 +3246,11 @@ def add_period():
         periods = load_periods()
         
         # Check for overlapping periods
-        for period in periods:
-            if not period.get('is_active', True):
-                continue
-            
-            existing_start = datetime.datetime.strptime(period['start_time'], '%H:%M:%S')
-            existing_end = datetime.datetime.strptime(period['end_time'], '%H:%M:%S')
-            
-            if (start_dt < existing_end and end_dt > existing_start):
-                flash(f"Period overlaps with {period['period_name']}", "error")
-                return redirect(url_for('add_period'))
+        overlap = find_overlapping_period(periods, _time_to_seconds(start_dt.time()),
+                                          _time_to_seconds(end_dt.time()))
+        if overlap:
+            flash(f"Period overlaps with {overlap['period_name']}", "error")
+            return redirect(url_for('add_period'))
         
         # Create new period
         new_period_id = max([p['period_id'] for p in periods], default=0) + 1
@@ -2121,8 +3258,8 @@ def add_period():
         new_period = {
             "period_id": new_period_id,
             "period_name": period_name,
-            "start_time": start_time + ":00",
-            "end_time": end_time + ":00",
+            "start_time": start_dt.strftime('%H:%M:%S'),
+            "end_time": end_dt.strftime('%H:%M:%S'),
             "duration_minutes": duration,
             "subject": subject,
             "teacher": teacher,
@@ -2177,16 +3314,11 @@ def edit_period(period_id):
             return redirect(url_for('edit_period', period_id=period_id))
         
         # Check for overlapping periods (excluding current period)
-        for p in periods:
-            if p['period_id'] == period_id or not p.get('is_active', True):
-                continue
-            
-            existing_start = datetime.datetime.strptime(p['start_time'], '%H:%M:%S')
-            existing_end = datetime.datetime.strptime(p['end_time'], '%H:%M:%S')
-            
-            if (start_dt < existing_end and end_dt > existing_start):
-                flash(f"Period overlaps with {p['period_name']}", "error")
-                return redirect(url_for('edit_period', period_id=period_id))
+        overlap = find_overlapping_period(periods, _time_to_seconds(start_dt.time()),
+                                          _time_to_seconds(end_dt.time()), exclude_id=period_id)
+        if overlap:
+            flash(f"Period overlaps with {overlap['period_name']}", "error")
+            return redirect(url_for('edit_period', period_id=period_id))
         
         # Update period
         for i, p in enumerate(periods):
@@ -2194,8 +3326,8 @@ def edit_period(period_id):
                 periods[i] = {
                     "period_id": period_id,
                     "period_name": period_name,
-                    "start_time": start_time + ":00",
-                    "end_time": end_time + ":00",
+                    "start_time": start_dt.strftime('%H:%M:%S'),
+                    "end_time": end_dt.strftime('%H:%M:%S'),
                     "duration_minutes": duration,
                     "subject": subject,
                     "teacher": teacher,
@@ -2263,149 +3395,197 @@ def attendance_period():
 def generate_period_attendance_frames():
     """Generate video feed with period-aware attendance tracking"""
     # Load Model
-    if not os.path.exists(MODEL_FILE):
+    recognizer = get_recognizer()
+    if recognizer is None:
         yield from error_frame("Model not found! Train first.")
         return
     
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(MODEL_FILE)
-    
-    students = load_students()
-    student_ids = {int(k): v for k, v in students.items() if k.isdigit()}
-    
-    camera = cv2.VideoCapture(0)
+    student_ids = get_student_ids()
     
     # Trackers for period transitions
     period_trackers = {}  # {roll_no: {current_period_id, last_seen_time, state}}
     current_period = get_current_period()
-    last_period_check = datetime.datetime.now()
+    last_period_check = time.monotonic()
+    frame_id = 0
+    frame_count = 0
+    face_bufs = [np.empty((4,) + FACE_SIZE, dtype=np.uint8)]  # Preprocessed ROIs (worker only), grown if needed
+    last_labels = []  # (x, y, w, h, display_name, display_color) from the last recognition pass
+    
+    def recognize(gray):
+        """Detect and identify faces; runs on the detector thread"""
+        faces = detect_faces(gray, 1.3, 5, min_size=(60, 60))
+        if len(faces) > len(face_bufs[0]):
+            face_bufs[0] = np.empty((len(faces),) + FACE_SIZE, dtype=np.uint8)
+        rois = face_bufs[0]
+        
+        # Preprocess every ROI into the stacked buffer first, then predict in one tight loop.
+        # Predict on the returned arrays: preprocess_face's fallback path doesn't write into out,
+        # so the buffer row could still hold a face from an earlier frame
+        processed = [preprocess_face(gray[y:y+h, x:x+w], out=rois[i])
+                     for i, (x, y, w, h) in enumerate(faces)]
+        
+        predict = recognizer.predict
+        results = []
+        for (x, y, w, h), face in zip(faces, processed):
+            try:
+                id_, confidence = predict(face)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                id_, confidence = None, None
+            results.append((x, y, w, h, id_, confidence))
+        return results
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # Check if period has changed (every 10 seconds)
-        now = datetime.datetime.now()
-        if (now - last_period_check).seconds >= 10:
-            new_period = get_current_period()
-            if new_period and current_period and new_period['period_id'] != current_period['period_id']:
-                # Period changed - reset trackers
-                period_trackers = {}
-                flash_message = f"Period changed: {current_period['period_name']} �    {new_period['period_name']}"
-                print(flash_message)
-                current_period = new_period
+    # Detection + prediction run on a worker thread over the newest submitted frame, so
+    # capture, drawing and JPEG encoding here overlap with the recognizer
+    detector = AsyncFaceDetector(recognize)
+    handled_seq = 0
+    
+    try:
+        while True:
+            # Only frames handed to the recognizer need gray; the broker converts each
+            # camera frame at most once and shares it with the other feeds
+            recognize_now = frame_count % DETECT_EVERY_N_FRAMES == 0
+            frame_id, frame, gray = camera_broker.read(frame_id + 1, with_gray=recognize_now)
+            if frame is None:
+                break
+            frame_count += 1
+        
+            if frame_count % STUDENT_RELOAD_FRAMES == 0:
+                student_ids = get_student_ids()
+        
+            # Check if period has changed (every 10 seconds); intervals use the monotonic
+            # clock so wall-clock jumps can't stall or re-trigger them
+            now = time.monotonic()
+            if now - last_period_check >= 10:
+                new_period = get_current_period()
+                if new_period and current_period and new_period['period_id'] != current_period['period_id']:
+                    # Period changed - reset trackers
+                    period_trackers = {}
+                    flash_message = f"Period changed: {current_period['period_name']} �    {new_period['period_name']}"
+                    print(flash_message)
+                    current_period = new_period
             
-            last_period_check = now
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+                last_period_check = now
+        
+            # Recognition is requested every N frames; frames in between redraw the last labels
+            if recognize_now:
+                detector.submit(gray)
+            seq, _, results = detector.latest()
+            if seq != handled_seq:
+                handled_seq = seq
+                last_labels = []
+            else:
+                results = ()
         
-        # Display current period info
-        if current_period:
-            period_info = f"{current_period['period_name']} ({current_period['start_time'][:5]} - {current_period['end_time'][:5]})"
-            cv2.putText(frame, period_info, (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+            # Display current period info
+            if current_period:
+                period_info = f"{current_period['period_name']} ({current_period['start_time'][:5]} - {current_period['end_time'][:5]})"
+                cv2.putText(frame, period_info, (10, 30), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
             
-            if current_period.get('is_break', False):
-                cv2.putText(frame, "BREAK TIME", (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        
-        # Draw line for entry/exit tracking
-        LINE_X = frame.shape[1] // 2
-        cv2.line(frame, (LINE_X, 0), (LINE_X, frame.shape[0]), (0, 255, 255), 2)
-        cv2.putText(frame, "EXIT <--- | ---> ENTRY", (10, frame.shape[0] - 20), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-        
-        for (x, y, w, h) in faces:
-            roi_gray = gray[y:y+h, x:x+w]
-            roi_gray = preprocess_face(roi_gray)
+                if current_period.get('is_break', False):
+                    cv2.putText(frame, "BREAK TIME", (10, 60), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        
+            # Draw line for entry/exit tracking
+            LINE_X = frame.shape[1] // 2
+            cv2.line(frame, (LINE_X, 0), (LINE_X, frame.shape[0]), (0, 255, 255), 2)
+            cv2.putText(frame, "EXIT <--- | ---> ENTRY", (10, frame.shape[0] - 20), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+        
+            for (x, y, w, h, id_, confidence) in results:
+                if id_ is None:
+                    last_labels.append((x, y, w, h, None, None))
+                    continue
             
-            try:
-                id_, confidence = recognizer.predict(roi_gray)
+                try:
+                    display_name = "Unknown"
+                    display_color = (0, 0, 255)
                 
-                display_name = "Unknown"
-                display_color = (0, 0, 255)
-                
-                if confidence < 70 and id_ in student_ids:
-                    name = student_ids[id_].get("name", "Unknown")
-                    display_name = f"{name}"
-                    display_color = (0, 255, 0)
+                    if confidence < 70 and id_ in student_ids:
+                        name = student_ids[id_].get("name", "Unknown")
+                        display_name = f"{name}"
+                        display_color = (0, 255, 0)
                     
-                    roll_no = str(id_)
-                    cx = x + w // 2
+                        roll_no = str(id_)
+                        cx = x + w // 2
                     
-                    # Period-aware attendance tracking
-                    if current_period and not current_period.get('is_break', False):
-                        if roll_no not in period_trackers:
-                            period_trackers[roll_no] = {
-                                'current_period_id': current_period['period_id'],
-                                'last_x': cx,
-                                'last_seen': now,
-                                'state': 'outside'  # outside, entering, inside, exiting
-                            }
-                        
-                        tracker = period_trackers[roll_no]
+                        # Period-aware attendance tracking
+                        if current_period and not current_period.get('is_break', False):
+                            # Re-inserted on every sighting so the dict stays ordered by last_seen
+                            tracker = period_trackers.pop(roll_no, None)
+                            if tracker is None:
+                                tracker = {
+                                    'current_period_id': current_period['period_id'],
+                                    'last_x': cx,
+                                    'last_seen': now,
+                                    'state': 'outside'  # outside, entering, inside, exiting
+                                }
+                            period_trackers[roll_no] = tracker
                         
-                        # Update tracker
-                        old_x = tracker['last_x']
-                        tracker['last_x'] = cx
-                        tracker['last_seen'] = now
+                            # Update tracker
+                            old_x = tracker['last_x']
+                            tracker['last_x'] = cx
+                            tracker['last_seen'] = now
                         
-                        # Determine movement direction
-                        if old_x < LINE_X and cx >= LINE_X:
-                            # Entry into classroom
-                            tracker['state'] = 'entering'
-                            entry_time = now.strftime("%H:%M:%S")
+                            # Determine movement direction
+                            if old_x < LINE_X and cx >= LINE_X:
+                                # Entry into classroom
+                                tracker['state'] = 'entering'
+                                entry_time = _local_hms(time.time())
                             
-                            # Mark attendance for current period
-                            mark_period_attendance(roll_no, current_period['period_id'], 
-                                                  entry_time=entry_time)
+                                # Mark attendance for current period
+                                mark_period_attendance(roll_no, current_period['period_id'], 
+                                                      entry_time=entry_time)
                             
-                            cv2.putText(frame, "ENTERED", (x, y-10), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                                cv2.putText(frame, "ENTERED", (x, y-10), 
+                                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                             
-                        elif old_x > LINE_X and cx <= LINE_X:
-                            # Exit from classroom
-                            tracker['state'] = 'exiting'
-                            exit_time = now.strftime("%H:%M:%S")
+                            elif old_x > LINE_X and cx <= LINE_X:
+                                # Exit from classroom
+                                tracker['state'] = 'exiting'
+                                exit_time = _local_hms(time.time())
                             
-                            # Mark exit for current period
-                            mark_period_attendance(roll_no, current_period['period_id'], 
-                                                  exit_time=exit_time)
+                                # Mark exit for current period
+                                mark_period_attendance(roll_no, current_period['period_id'], 
+                                                      exit_time=exit_time)
                             
-                            cv2.putText(frame, "EXITED", (x, y-10), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                                cv2.putText(frame, "EXITED", (x, y-10), 
+                                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
                 
-                cv2.putText(frame, display_name, (x, y+h+20), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, display_color, 2)
+                    last_labels.append((x, y, w, h, display_name, display_color))
                 
-            except Exception as e:
-                print(f"Recognition error: {e}")
-            
-            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-        
-        # Cleanup old trackers (5 minutes inactive)
-        inactive_rolls = []
-        for roll_no, tracker in period_trackers.items():
-            if (now - tracker['last_seen']).seconds > 300:  # 5 minutes
-                inactive_rolls.append(roll_no)
-        
-        for roll_no in inactive_rolls:
-            del period_trackers[roll_no]
-        
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    
-    camera.release()
+                except Exception as e:
+                    print(f"Attendance tracking error: {e}")
+                    last_labels.append((x, y, w, h, None, None))
+        
+            for (x, y, w, h, display_name, display_color) in last_labels:
+                if display_name is not None:
+                    cv2.putText(frame, display_name, (x, y+h+20), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, display_color, 2)
+                cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+        
+            # Cleanup old trackers (5 minutes inactive); least recently seen come first,
+            # so this stops at the first tracker that is still fresh
+            while period_trackers:
+                roll_no, tracker = next(iter(period_trackers.items()))
+                if now - tracker['last_seen'] <= 300:  # 5 minutes
+                    break
+                del period_trackers[roll_no]
+        
+            frame = encode_jpeg(downscale_for_stream(frame))
+            if not frame:
+                continue
+            yield MJPEG_PART_HEADER + frame + b'\r\n'
+    finally:
+        detector.stop()
 
 @app.route("/video_feed_period")
 def video_feed_period():
     """Video feed for period-wise attendance"""
     return Response(generate_period_attendance_frames(), 
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers=STREAM_HEADERS)
 
 # ==================== PERIOD-WISE REPORTS ====================
 @app.route("/reports/period")
@@ -2461,6 +3641,20 @@ def student_period_report(roll_no):
                          period_details=period_details,
                          student_data=student_data)
 
+# Column headers of the four sheets written by export_period_attendance
+PERIOD_EXPORT_SUMMARY_HEADER = ('Roll Number', 'Student Name', 'Total Periods', 'Present Periods',
+                                'Absent Periods', 'Attendance %', 'Total Duration')
+PERIOD_EXPORT_DETAILS_HEADER = ('Period ID', 'Period Name', 'Time', 'Subject', 'Teacher', 'Roll Number',
+                                'Student Name', 'Entry Time', 'Exit Time', 'Duration', 'Present',
+                                'Attendance %')
+PERIOD_EXPORT_PERIOD_SUMMARY_HEADER = ('Period ID', 'Period Name', 'Subject', 'Teacher', 'Total Students',
+                                       'Present Students', 'Absent Students', 'Attendance %',
+                                       'Average Duration')
+PERIOD_EXPORT_TIMELINE_HEADER = ('Time Slot', 'Period', 'Type', 'Roll Number', 'Student Name', 'Status',
+                                 'Entry', 'Exit', 'Duration')
+# Shared read-only default for students with no attendance record (for the day or a period)
+EMPTY_PERIOD_RECORD = {}
+
 @app.route("/export/period")
 @login_required
 @role_required('admin', 'teacher')
@@ -2470,138 +3664,149 @@ def export_period_attendance():
     date_str = request.args.get('date', datetime.datetime.now().strftime("%Y-%m-%d"))
     
     # Load data
-    attendance_data = load_period_attendance()
+    attendance_data = load_period_attendance(date_str)
     students = load_students()
     periods = load_periods()
     
     # Filter active, non-break periods
     active_periods = [p for p in periods if p.get('is_active', True) and not p.get('is_break', False)]
     
-    # Create Excel writer
     output_file = f'period_attendance_{date_str}.xlsx'
-    output_path = os.path.join(BASE_DIR, output_file)
     
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        # Sheet 1: Daily Summary (Total Overall Report)
-        summary_data = []
-        day_data = attendance_data.get(date_str, {})
-        
-        for roll_no, student_info in students.items():
-            student_attendance = day_data.get(roll_no, {}) if day_data else {}
-            
-            total_present = student_attendance.get('total_present', 0)
-            total_duration = student_attendance.get('total_duration', '00:00:00')
-            
-            summary_data.append({
-                'Roll Number': roll_no,
-                'Student Name': student_info.get('name', ''),
-                'Total Periods': len(active_periods),
-                'Present Periods': total_present,
-                'Absent Periods': len(active_periods) - total_present,
-                'Attendance %': round((total_present / len(active_periods)) * 100, 2) if active_periods else 0,
-                'Total Duration': total_duration
-            })
-        
-        df_summary = pd.DataFrame(summary_data)
-        df_summary.to_excel(writer, sheet_name='Daily Summary', index=False)
-        
-        # Sheet 2: Period-wise Details (Each Student Details per Period)
-        period_details_data = []
-        
-        for period in active_periods:
-            period_id = period['period_id']
-            
-            for roll_no, student_info in students.items():
-                student_attendance = day_data.get(roll_no, {}) if day_data else {}
-                period_data = student_attendance.get('periods', {}).get(str(period_id), {})
-                
-                period_details_data.append({
-                    'Period ID': period_id,
-                    'Period Name': period['period_name'],
-                    'Time': f"{period['start_time'][:5]} - {period['end_time'][:5]}",
-                    'Subject': period['subject'],
-                    'Teacher': period['teacher'],
-                    'Roll Number': roll_no,
-                    'Student Name': student_info.get('name', ''),
-                    'Entry Time': period_data.get('entry', 'ABSENT'),
-                    'Exit Time': period_data.get('exit', 'ABSENT'),
-                    'Duration': period_data.get('duration', '00:00:00'),
-                    'Present': 'YES' if period_data.get('present', False) else 'NO',
-                    'Attendance %': period_data.get('attendance_percentage', 0)
-                })
-        
-        df_period_details = pd.DataFrame(period_details_data)
-        df_period_details.to_excel(writer, sheet_name='Period Details', index=False)
-        
-        # Sheet 3: Period-wise Summary (Each Period Summary)
-        period_summary_data = []
-        for period in active_periods:
-            period_id = period['period_id']
-            
-            present_count = 0
-            total_duration = datetime.timedelta()
-            
-            for roll_no, student_attendance in day_data.items():
-                period_data = student_attendance.get('periods', {}).get(str(period_id), {})
-                if period_data.get('present', False):
-                    present_count += 1
-                    if period_data.get('duration'):
-                        try:
-                            h, m, s = map(int, period_data['duration'].split(':'))
-                            total_duration += datetime.timedelta(hours=h, minutes=m, seconds=s)
-                        except:
-                            pass
-            
-            avg_duration = total_duration / present_count if present_count > 0 else datetime.timedelta()
+    # Sheet 1: Daily Summary (Total Overall Report)
+    summary_rows = []
+    day_data = attendance_data.get(date_str, {})
+    student_rows = [(roll_no, student_info.get('name', '')) for roll_no, student_info in students.items()]
+    n_active = len(active_periods)
+    inv_active = 100.0 / n_active if n_active else 0.0
+    
+    for roll_no, name in student_rows:
+        student_attendance = day_data.get(roll_no, EMPTY_PERIOD_RECORD)
+        
+        total_present = student_attendance.get('total_present', 0)
+        
+        summary_rows.append((
+            roll_no,
+            name,
+            n_active,
+            total_present,
+            n_active - total_present,
+            round(total_present * inv_active, 2),
+            student_attendance.get('total_duration', '00:00:00')
+        ))
+    
+    # (roll_no, period_id_str) -> period record, flattened once for the per-period sheets
+    records = {(roll_no, period_id_str): period_data
+               for roll_no, student_attendance in day_data.items()
+               for period_id_str, period_data in student_attendance.get('periods', {}).items()}
+    
+    # Sheet 2: Period-wise Details (Each Student Details per Period)
+    period_details_rows = []
+    period_fields = [(p['period_id'], str(p['period_id']), p['period_name'],
+                      f"{p['start_time'][:5]} - {p['end_time'][:5]}", p['subject'], p['teacher'])
+                     for p in active_periods]
+    
+    for period_id, period_id_str, period_name, time_slot, subject, teacher in period_fields:
+        for roll_no, name in student_rows:
+            g = records.get((roll_no, period_id_str), EMPTY_PERIOD_RECORD).get
             
-            period_summary_data.append({
-                'Period ID': period_id,
-                'Period Name': period['period_name'],
-                'Subject': period['subject'],
-                'Teacher': period['teacher'],
-                'Total Students': len(students),
-                'Present Students': present_count,
-                'Absent Students': len(students) - present_count,
-                'Attendance %': round((present_count / len(students)) * 100, 2) if len(students) > 0 else 0,
-                'Average Duration': str(avg_duration)[:7] if present_count > 0 else '00:00:00'
-            })
+            period_details_rows.append((
+                period_id,
+                period_name,
+                time_slot,
+                subject,
+                teacher,
+                roll_no,
+                name,
+                g('entry', 'ABSENT'),
+                g('exit', 'ABSENT'),
+                g('duration', '00:00:00'),
+                'YES' if g('present', False) else 'NO',
+                g('attendance_percentage', 0)
+            ))
+    
+    # Sheet 3: Period-wise Summary (Each Period Summary), reduced column-wise over
+    # (student x period) present/duration matrices filled in one pass over the records
+    roll_index = {roll_no: i for i, roll_no in enumerate(day_data)}
+    column_index = {fields[1]: j for j, fields in enumerate(period_fields)}
+    present = np.zeros((len(roll_index), len(period_fields)), dtype=bool)
+    durations = np.zeros(present.shape, dtype=np.int32)
+    cells, duration_strs = [], []
+    
+    for (roll_no, period_id_str), period_data in records.items():
+        j = column_index.get(period_id_str)
+        if j is None or not period_data.get('present', False):
+            continue
+        cells.append((roll_index[roll_no], j))
+        duration_strs.append(period_data.get('duration') or '00:00:00')
+    
+    if cells:
+        rows, cols = np.array(cells, dtype=np.intp).T
+        present[rows, cols] = True
+        # Durations come from _seconds_to_hms, so they are always fixed-width
+        durations[rows, cols] = _hms_array_to_seconds(duration_strs)
+    
+    present_counts = present.sum(axis=0)
+    avg_seconds = np.divide(durations.sum(axis=0), present_counts,
+                            out=np.zeros(len(period_fields)), where=present_counts > 0)
+    
+    n_students = len(students)
+    inv_students = 100.0 / n_students if n_students else 0.0
+    
+    period_summary_rows = []
+    for (period_id, _, period_name, _, subject, teacher), present_count, avg in zip(
+            period_fields, present_counts.tolist(), avg_seconds.tolist()):
+        period_summary_rows.append((
+            period_id,
+            period_name,
+            subject,
+            teacher,
+            n_students,
+            present_count,
+            n_students - present_count,
+            round(present_count * inv_students, 2),
+            _seconds_to_hms(int(avg)) if present_count > 0 else '00:00:00'
+        ))
+    
+    # Sheet 4: Student Timeline
+    timeline_rows = []
+    for period in periods:  # Include breaks
+        if not period.get('is_active', True):
+            continue
         
-        df_period_summary = pd.DataFrame(period_summary_data)
-        df_period_summary.to_excel(writer, sheet_name='Period Summary', index=False)
+        period_id_str = str(period['period_id'])
+        is_break = period.get('is_break', False)
+        time_slot = f"{period['start_time'][:5]} - {period['end_time'][:5]}"
+        period_name = period['period_name']
+        period_type = 'BREAK' if is_break else 'CLASS'
+        absent_status = 'BREAK' if is_break else 'ABSENT'
+        present_status = 'BREAK_PRESENT' if is_break else 'PRESENT'
         
-        # Sheet 4: Student Timeline
-        timeline_data = []
-        for period in periods:  # Include breaks
-            if not period.get('is_active', True):
-                continue
+        for roll_no, name in student_rows:
+            g = records.get((roll_no, period_id_str), EMPTY_PERIOD_RECORD).get
             
-            period_id = period['period_id']
-            is_break = period.get('is_break', False)
-            
-            for roll_no, student_info in students.items():
-                student_attendance = day_data.get(roll_no, {}) if day_data else {}
-                period_data = student_attendance.get('periods', {}).get(str(period_id), {})
-                
-                status = 'BREAK' if is_break else 'ABSENT'
-                if period_data.get('present', False):
-                    status = 'PRESENT' if not is_break else 'BREAK_PRESENT'
-                
-                timeline_data.append({
-                    'Time Slot': f"{period['start_time'][:5]} - {period['end_time'][:5]}",
-                    'Period': period['period_name'],
-                    'Type': 'BREAK' if is_break else 'CLASS',
-                    'Roll Number': roll_no,
-                    'Student Name': student_info.get('name', ''),
-                    'Status': status,
-                    'Entry': period_data.get('entry', '-'),
-                    'Exit': period_data.get('exit', '-'),
-                    'Duration': period_data.get('duration', '00:00:00')
-                })
-        
-        df_timeline = pd.DataFrame(timeline_data)
-        df_timeline.to_excel(writer, sheet_name='Student Timeline', index=False)
-    
-    return send_file(output_path, as_attachment=True)
+            timeline_rows.append((
+                time_slot,
+                period_name,
+                period_type,
+                roll_no,
+                name,
+                present_status if g('present', False) else absent_status,
+                g('entry', '-'),
+                g('exit', '-'),
+                g('duration', '00:00:00')
+            ))
+    
+    buf = io.BytesIO()
+    write_xlsx(buf, [
+        ('Daily Summary', PERIOD_EXPORT_SUMMARY_HEADER, summary_rows),
+        ('Period Details', PERIOD_EXPORT_DETAILS_HEADER, period_details_rows),
+        ('Period Summary', PERIOD_EXPORT_PERIOD_SUMMARY_HEADER, period_summary_rows),
+        ('Student Timeline', PERIOD_EXPORT_TIMELINE_HEADER, timeline_rows),
+    ])
+    buf.seek(0)
+    
+    return send_file(buf, as_attachment=True, download_name=output_file, mimetype=XLSX_MIMETYPE)
 
 # Helper for video feed
 def error_frame(message):
@@ -2609,10 +3814,8 @@ def error_frame(message):
     frame = np.zeros((480, 640, 3), dtype=np.uint8)
     cv2.putText(frame, message, (50, 240), 
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-    ret, buffer = cv2.imencode('.jpg', frame)
-    frame = buffer.tobytes()
-    yield (b'--frame\r\n'
-           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    frame = encode_jpeg(frame)
+    yield MJPEG_PART_HEADER + frame + b'\r\n'
 
 
 # ==================== ATTENDANCE LOG API & PAGES ====================
@@ -2623,17 +3826,16 @@ def error_frame(message):
 def get_attendance_log():
     """Get attendance log data"""
     try:
-        log_entries = list(attendance_log)
-        
-        # Calculate statistics
-        total_entries = len(log_entries)
-        students_present = len(set([e['roll_no'] for e in log_entries if e['event_type'] == 'ENTRY' and e['roll_no'] != 'unknown']))
-        # Subtract exits from entries for current in-class count (simplified)
-        unknown_detected = len([e for e in log_entries if e['event_type'] == 'UNKNOWN_DETECTED'])
+        with _attendance_log_lock:
+            # Statistics are maintained as entries are logged
+            total_entries = len(attendance_log)
+            students_present = len(_attendance_log_stats["present"])
+            unknown_detected = _attendance_log_stats["unknown"]
+            # Last 50 entries for display, newest first
+            recent_entries = list(islice(reversed(attendance_log), 50))
         
-        # Prepare log entries for display (last 50)
         formatted_entries = []
-        for entry in reversed(log_entries):
+        for entry in recent_entries:
             formatted_entry = {
                 'timestamp': entry['timestamp'],
                 'event_type': entry['event_type'],
@@ -2642,7 +3844,6 @@ def get_attendance_log():
                 'confidence': int(entry['confidence']) if entry['confidence'] else 0
             }
             formatted_entries.append(formatted_entry)
-            if len(formatted_entries) >= 50: break
         
         return jsonify({
             'success': True,
@@ -2662,10 +3863,15 @@ def get_attendance_log():
 @antigravity_trace
 def clear_attendance_log():
     """Clear attendance log"""
-    global attendance_log
-    attendance_log.clear()
+    with _attendance_log_lock:
+        attendance_log.clear()
+        _attendance_log_stats["present"].clear()
+        _attendance_log_stats["unknown"] = 0
     return jsonify({'success': True, 'message': 'Log cleared successfully'})
 
+# Columns of the attendance log export, in log_attendance_event's field order
+ATTENDANCE_LOG_EXPORT_HEADER = ('timestamp', 'event_type', 'roll_no', 'name', 'confidence', 'quality_metrics')
+
 @app.route("/export/attendance-log")
 @login_required
 @role_required('admin', 'teacher')
@@ -2673,16 +3879,21 @@ def clear_attendance_log():
 def export_attendance_log():
     """Export attendance log to Excel"""
     try:
-        log_entries = list(attendance_log)
+        with _attendance_log_lock:
+            log_entries = list(attendance_log)
         if not log_entries:
             flash("No attendance log data to export", "warning")
             return redirect(url_for('attendance_log_page'))
         
-        df = pd.DataFrame(log_entries)
+        # quality_metrics is a dict, which spreadsheet cells cannot hold, so it is written as text
+        rows = ((e['timestamp'], e['event_type'], e['roll_no'], e['name'], e['confidence'],
+                 str(e['quality_metrics']) if e['quality_metrics'] is not None else None)
+                for e in log_entries)
         filename = f'attendance_log_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        filepath = os.path.join(BASE_DIR, filename)
-        df.to_excel(filepath, index=False)
-        return send_file(filepath, as_attachment=True)
+        buf = io.BytesIO()
+        write_xlsx(buf, [('Sheet1', ATTENDANCE_LOG_EXPORT_HEADER, rows)])
+        buf.seek(0)
+        return send_file(buf, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
     except Exception as e:
         flash(f"Error exporting log: {str(e)}", "error")
         return redirect(url_for('attendance_log_page'))
@@ -2721,8 +3932,13 @@ def help_page():
     """Help and user manual page"""
     return render_template("help.html")
 
+# Bootstrap once at import so load_users() never has to check for a missing file
+_ensure_users_file()
+# Create/migrate the period attendance database before any stream marks attendance
+_init_period_db()
 
 if __name__ == "__main__":
 
-    app.run(debug=True)
+    # Threaded so /logs, exports and API calls aren't blocked behind an open video stream
+    app.run(debug=False, threaded=True)
 
@@ -17,6 +17,9 @@ LOG_FILE = 'app.log'
 MAX_BYTES = 10 * 1024 * 1024  # 10 MB
 BACKUP_COUNT = 5
 
+# Set TRACE_DISABLED=1 to leave functions undecorated (no per-call trace overhead)
+TRACE_DISABLED = os.getenv('TRACE_DISABLED', '').lower() in ('1', 'true', 'yes')
+
 # Global listener reference to prevent garbage collection
 _listener = None
 
@@ -61,6 +64,27 @@ def setup_logger(name=__name__):
 
     return logger
 
+def setup_async_console_logger(name):
+    """
+    Logger whose records are printed to the console by a background QueueListener,
+    so hot paths (video loops) only enqueue a record instead of blocking on stdout.
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False  # Keep these out of the traced app logger
+
+        log_queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(log_queue))
+
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        listener = QueueListener(log_queue, console_handler)
+        listener.start()
+        atexit.register(listener.stop)
+
+    return logger
+
 def export_logs_to_json(json_path='logs_export.json'):
     """
     Reads the log file and exports it to a JSON format.
@@ -115,7 +139,13 @@ def antigravity_trace(func):
     - Captures Runtime Values (via track_runtime_value).
     - Measures Duration.
     - Non-blocking logging.
+    
+    Returns func unchanged when tracing is disabled or the logger would drop
+    the INFO-level trace records anyway.
     """
+    if TRACE_DISABLED or not logger.isEnabledFor(logging.INFO):
+        return func
+    
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         # Reset context for this call